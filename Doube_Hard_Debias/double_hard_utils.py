@@ -1,5 +1,7 @@
 import string 
-from tqdm import tqdm
+import re
+import os
+import hashlib
 import pickle
 
 import scipy
@@ -32,33 +34,39 @@ def has_digit(w):
         return True
     return False
 
-def limit_vocab(wv, w2i, vocab, exclude = None):
-    vocab_limited = []
-    for w in tqdm(vocab[:193978]): 
-        if w.lower() != w:
-            continue
-        #if len(w) >= 20:
-            #continue
-        #if has_digit(w):
-            #continue
-        if '_' in w:
-            p = [has_punct(subw) for subw in w.split('_')]
-            if not any(p):
-                vocab_limited.append(w)
-            continue
-        if has_punct(w):
-            continue
-        vocab_limited.append(w)
-    
-    if exclude:
-        vocab_limited = list(set(vocab_limited) - set(exclude))
+# punctuation other than '_', which joins the sub-tokens of phrases
+PUNCT_RE = re.compile('[' + re.escape(string.punctuation.replace('_', '')) + ']')
+
+def limit_vocab_mask(vocab, exclude = None, size = 193978, cache_dir = None):
     
-    print("size of vocabulary:", len(vocab_limited))
+    # keep lower case words without punctuation, where phrases joined by '_' may have no punctuation
+    # in any sub-token; the mask can be cached per vocab, exclude list and size
+    if cache_dir:
+        h = hashlib.sha1('\n'.join(vocab[:size]).encode('utf-8'))
+        h.update('\n'.join(sorted(exclude or [])).encode('utf-8'))
+        path = os.path.join(cache_dir, 'limit_vocab_{}.npy'.format(h.hexdigest()))
+        if os.path.exists(path):
+            return np.load(path)
+    
+    exclude = set(exclude or [])
+    words = vocab[:size]
+    keep = np.fromiter((w.lower() == w and not PUNCT_RE.search(w) and w not in exclude for w in words),
+                       dtype=bool, count=len(words))
     
-    wv_limited = np.zeros((len(vocab_limited), len(wv[0, :])))
-    for i,w in enumerate(vocab_limited):
-        wv_limited[i,:] = wv[w2i[w],:]
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(path, keep)
+    return keep
+
+def limit_vocab(wv, w2i, vocab, exclude = None, size = 193978, cache_dir = None):
+    
+    keep = limit_vocab_mask(vocab, exclude, size, cache_dir)
+    idx = np.flatnonzero(keep)
+    vocab_limited = [vocab[i] for i in idx]
     
+    print("size of vocabulary:", len(vocab_limited))
+    
+    wv_limited = wv[idx, :]
     w2i_limited = {w: i for i, w in enumerate(vocab_limited)}
     
     return vocab_limited, wv_limited, w2i_limited
@@ -69,20 +77,107 @@ def norm_stand(wv):
     W_norm = (wv.T / d).T
     return W_norm
 
+class EmbeddingMatrix:
+    
+    # float32 word vectors with their vocabulary, cached row norms and a lazily built unit-normalized view;
+    # indexing, .dot, .T and .shape go to the vectors, so it can be passed wherever wv is expected
+    __slots__ = ('vectors', 'vocab', 'w2i', '_norms', '_unit')
+    
+    def __init__(self, vectors, vocab, w2i = None, norms = None, unit = None):
+        # no copy for float32 arrays, including memory maps from utils/load_vectors.load_npy_arrays
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.vocab = vocab
+        self.w2i = w2i if w2i is not None else {w: i for i, w in enumerate(vocab)}
+        self._norms = norms
+        self._unit = unit
+    
+    @classmethod
+    def from_triple(cls, wv, w2i, vocab):
+        return cls(wv, vocab, w2i)
+    
+    @property
+    def norms(self):
+        if self._norms is None:
+            self._norms = np.sqrt(np.einsum('ij,ij->i', self.vectors, self.vectors))
+        return self._norms
+    
+    @property
+    def unit(self):
+        if self._unit is None:
+            self._unit = self.vectors / self.norms[:, np.newaxis]
+        return self._unit
+    
+    def normalized(self):
+        # unit vectors as an EmbeddingMatrix sharing the vocabulary, built once and then reused
+        return EmbeddingMatrix(self.unit, self.vocab, self.w2i, np.ones(len(self.vocab), dtype=np.float32), self.unit)
+    
+    def indices(self, words, skip_missing = False):
+        # batched word -> row lookup
+        if skip_missing:
+            words = [w for w in words if w in self.w2i]
+        return np.fromiter((self.w2i[w] for w in words), dtype=np.int64, count=len(words))
+    
+    def rows(self, words, unit = False):
+        return (self.unit if unit else self.vectors)[self.indices(words)]
+    
+    def subset(self, start, stop):
+        # rows start:stop as views of the vectors, norms and unit vectors, without copying
+        vocab = self.vocab[start:stop]
+        return EmbeddingMatrix(self.vectors[start:stop], vocab, None,
+                               None if self._norms is None else self._norms[start:stop],
+                               None if self._unit is None else self._unit[start:stop])
+    
+    def triple(self):
+        return self.vectors, self.w2i, self.vocab
+    
+    def __getitem__(self, key):
+        return self.vectors[key]
+    
+    def __len__(self):
+        return len(self.vectors)
+    
+    def __array__(self, dtype = None):
+        return self.vectors if dtype is None else self.vectors.astype(dtype)
+    
+    def dot(self, other):
+        return self.vectors.dot(other)
+    
+    @property
+    def T(self):
+        return self.vectors.T
+    
+    @property
+    def shape(self):
+        return self.vectors.shape
+    
+    @property
+    def dtype(self):
+        return self.vectors.dtype
+
+
 def normalize(wv):
     
+    # an EmbeddingMatrix normalizes once and reuses the result
+    if isinstance(wv, EmbeddingMatrix):
+        return wv.normalized()
+    
     # normalize vectors
-    norms = np.apply_along_axis(LA.norm, 1, wv)
+    norms = LA.norm(wv, axis=1)
     wv = wv / norms[:, np.newaxis]
     return wv
 
 
-def topK(w, wv, w2i, vocab, k=10):
+def topK(w, wv, w2i, vocab, k=10, index=None):
     
     # extract the word vector for word w
     idx = w2i[w]
     vec = wv[idx, :]
     
+    # approximate search with an index built over wv (e.g. utils/ann_index.IVFIndex)
+    if index is not None:
+        best = index.search(vec, k=k+1)[0][0]
+        return [vocab[i] for i in best if i!=idx and i >= 0]
+    
     # compute similarity of w with all words in the vocabulary
     sim = wv.dot(vec)
 #     sim = []
@@ -99,10 +194,36 @@ def topK(w, wv, w2i, vocab, k=10):
     return [vocab[i] for i in best if i!=idx]
 
 
+def topK_batch(words, wv, w2i, k=10, max_memory=2**30):
+    
+    # neighbor indices (most similar first, excluding the word itself) for many words at once;
+    # queries are processed in blocks so the block x vocabulary similarities and the int64 indices
+    # returned by argpartition together stay under max_memory bytes
+    idx = np.array([w2i[w] for w in words], dtype=np.int64)
+    best = np.zeros((len(idx), k), dtype=np.int64)
+    block = max(1, int(max_memory // (wv.shape[0] * (wv.dtype.itemsize + 8))))
+    
+    for start in range(0, len(idx), block):
+        q = idx[start:start+block]
+        # negated in place, so the smallest entries are the most similar words without a second copy
+        dist = wv[q, :].dot(wv.T)
+        np.negative(dist, out=dist)
+        dist[np.arange(len(q)), q] = np.inf
+        
+        # argpartition finds the k best in linear time, then only those k are sorted
+        part = np.argpartition(dist, k-1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(dist, part, axis=1), axis=1)
+        best[start:start+len(q)] = np.take_along_axis(part, order, axis=1)
+    
+    return best
+
+
 def similarity(w1, w2, wv, w2i):
     
     i1 = w2i[w1]
     i2 = w2i[w2]
+    if isinstance(wv, EmbeddingMatrix):
+        return float(wv.unit[i1].dot(wv.unit[i2]))
     vec1 = wv[i1, :]
     vec2 = wv[i2, :]
 
@@ -116,7 +237,48 @@ def drop(u, v):
 from sklearn.decomposition import PCA
 from sklearn import preprocessing
 
-def doPCA(pairs, wv, w2i):
+def fit_pca(matrix, n_components=None):
+    
+    # full PCA, or randomized truncated SVD on float32 data when only the top components are needed
+    if n_components is None or n_components >= min(matrix.shape):
+        pca = PCA()
+    else:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        pca = PCA(n_components=n_components, svd_solver='randomized', random_state=0)
+    pca.fit(matrix)
+    return pca
+
+
+def update_hash(h, file):
+    
+    # feed the content of a file into the hash object h, in blocks; also used by calculate_weat/weat_cache
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    return h
+
+
+def file_hash(file):
+    
+    return update_hash(hashlib.sha1(), file).hexdigest()
+
+
+def cached_pca(wv, file, n_components=20, cache_dir='pca_cache'):
+    
+    # main PCA components of the embeddings, cached on disk by the hash of the embedding file
+    path = os.path.join(cache_dir, '{}_{}.pkl'.format(file_hash(file), n_components))
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    
+    pca = fit_pca(wv, n_components)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, 'wb') as f:
+        pickle.dump(pca, f)
+    return pca
+
+
+def doPCA(pairs, wv, w2i, n_components=None):
         
     matrix = []
     cnt = 0
@@ -135,69 +297,171 @@ def doPCA(pairs, wv, w2i):
             cnt += 1
         
         embeds = np.array(matrix)
-        wv_mean = np.mean(np.array(embeds), axis=0)
-        wv_hat = np.zeros(embeds.shape).astype(float)
-    
-        for i in range(len(embeds)):
-            wv_hat[i, :] = embeds[i, :] - wv_mean
-        matrix = wv_hat
+        matrix = embeds - np.mean(embeds, axis=0)
             
     matrix = np.array(matrix)
-    pca = PCA()
-    pca.fit(matrix)
+    pca = fit_pca(matrix, n_components)
     print('pairs used in PCA: ', cnt)
     return pca
 
-# get tuples of biases and counts of masculine/feminine NN for each word (for bias-by-neighbors)
-import operator
-def bias_by_neighbors(wv, w2i, vocab, gender_bias_bef, size, neighbours_num = 100):
+def hard_debias(wv, w2i, w2i_partial, vocab_partial, main_pca, wv_mean, definitional_pairs, component_ids,
+                chunk_size=None, out=None):
+    
+    # remove the frequency components D = main_pca.components_[component_ids] and the mean,
+    # then drop the bias direction found by doPCA over definitional_pairs, for all words at once
+    D = main_pca.components_[list(component_ids)]
+    rows = np.array([w2i[w] for w in vocab_partial])
+    targets = np.array([w2i_partial[w] for w in vocab_partial])
+    
+    # chunk_size bounds the temporary copies for matrices that barely fit in memory; out may be a np.memmap
+    if out is None:
+        out = np.zeros((len(vocab_partial), wv.shape[1]), dtype=wv.dtype)
+    chunk_size = chunk_size or len(rows)
+    
+    # get rid of frequency features
+    for start in range(0, len(rows), chunk_size):
+        u = np.asarray(wv[rows[start:start+chunk_size], :])
+        out[targets[start:start+chunk_size], :] = u - u.dot(D.T).dot(D) - wv_mean
+    
+    # debias
+    political_directions = [doPCA(definitional_pairs, out, w2i_partial).components_[0]]
+    for start in range(0, len(out), chunk_size):
+        u = out[start:start+chunk_size, :]
+        for v in political_directions:
+            u -= np.outer(u.dot(v), v) / v.dot(v)
+    
+    return out
+
+def save_vectors(file, vocab, sources, fmt='txt', chunk_size=10000):
+    
+    # write the vectors of vocab in order, in chunks, without building per-float strings or a merged matrix;
+    # sources is a list of (words, wv, w2i) and a word takes its row from the last source listing it
+    if fmt not in ('txt', 'bin', 'npy'):
+        raise ValueError('unknown embedding format: {}'.format(fmt))
+    
+    lookup = {}
+    for s, (words, _, w2i) in enumerate(sources):
+        for w in words:
+            lookup[w] = (s, w2i[w])
+    dim = sources[0][1].shape[1]
+    
+    def chunks():
+        for start in range(0, len(vocab), chunk_size):
+            words = vocab[start:start+chunk_size]
+            src = np.array([lookup[w][0] for w in words])
+            idx = np.array([lookup[w][1] for w in words])
+            chunk = np.zeros((len(words), dim), dtype=np.float64 if fmt == 'txt' else np.float32)
+            for s, (_, wv, _) in enumerate(sources):
+                chunk[src == s] = wv[idx[src == s], :]
+            yield start, words, chunk
+    
+    if fmt == 'npy':
+        # same layout as utils/load_vectors.convert_txt_to_npy: <file>.npy and <file>.vocab
+        out = np.lib.format.open_memmap(file + '.npy', mode='w+', dtype=np.float32, shape=(len(vocab), dim))
+        with open(file + '.vocab', 'w', encoding='utf-8', newline='') as f:
+            for w in vocab:
+                f.write(w + '\n')
+        for start, words, chunk in chunks():
+            out[start:start+len(words)] = chunk
+        out.flush()
+        return
     
-    tuples = []
+    with open(file, 'w' if fmt == 'txt' else 'wb') as f:
+        header = '{} {}\n'.format(len(vocab), dim)
+        f.write(header if fmt == 'txt' else header.encode('utf-8'))
+        row_fmt = ' '.join(['%.8f'] * dim)
+        for _, words, chunk in chunks():
+            if fmt == 'txt':
+                f.write(''.join('%s %s\n' % (w, row_fmt % tuple(row)) for w, row in zip(words, chunk)))
+            else:
+                # word2vec binary format, as written by gensim's save_word2vec_format(binary=True)
+                f.write(b''.join(w.encode('utf-8') + b' ' + row.tobytes() for w, row in zip(words, chunk)))
+
+def bias_by_projection(wv, anchors):
     
-    sorted_g = sorted(gender_bias_bef.items(), key=operator.itemgetter(1))
-    female = [item[0] for item in sorted_g[:size]]
-    male = [item[0] for item in sorted_g[-size:]]
-#     vocab = male + female
-    selected = female + male if size > 0 else vocab
+    # cos(u, a) - cos(u, b) for every word vector u, as one matrix-vector product with a/|a| - b/|b|;
+    # anchors is one (a, b) pair of vectors, or a list of pairs giving one column per pair
+    pairs = [anchors] if isinstance(anchors, tuple) else anchors
+    D = np.array([a / LA.norm(a) - b / LA.norm(b) for a, b in pairs]).T
+    norms = wv.norms if isinstance(wv, EmbeddingMatrix) else np.sqrt(np.einsum('ij,ij->i', wv, wv))
+    bias = wv.dot(D) / norms[:, np.newaxis]
+    return bias[:, 0] if isinstance(anchors, tuple) else bias
+
+
+def extreme_words(bias, vocab, n_low, n_high):
     
-    for w in selected:
-        
-        top = topK(w, wv, w2i, vocab, k=neighbours_num+5)[:neighbours_num]
+    # the n_low most negative and n_high most positive words in ascending order of bias, as the first and
+    # last items of the vocab sorted by bias, found with argpartition instead of a full sort;
+    # counts are clamped to the vocab size, since argpartition only accepts 0 <= kth < len(bias)
+    bias = np.asarray(bias)
+    n_low = min(n_low, len(bias))
+    n_high = min(n_high, len(bias))
+    low = np.argpartition(bias, n_low - 1)[:n_low] if n_low > 0 else np.zeros(0, dtype=np.int64)
+    low = low[np.argsort(bias[low])]
+    high = np.argpartition(bias, len(bias) - n_high)[len(bias) - n_high:] if n_high > 0 else np.zeros(0, dtype=np.int64)
+    high = high[np.argsort(bias[high])]
+    return [vocab[i] for i in low], [vocab[i] for i in high]
 
-        m = 0
-        f = 0    
-        for t in top:
-            if gender_bias_bef[t] > 0:
-                m+=1
-            else:
-                f+=1
-            
-        tuples.append((w, gender_bias_bef[w], m, f))
+# get tuples of biases and counts of masculine/feminine NN for each word (for bias-by-neighbors),
+# as a structured array with one record (word, bias, m, f) per word
+NEIGHBOR_DTYPE = np.dtype([('word', object), ('bias', np.float64), ('m', np.int64), ('f', np.int64)])
 
-    return tuples
+def bias_array(bias, vocab):
+    
+    # bias labels aligned with vocab; a dict from words to bias is looked up once per word,
+    # and words missing from the dict get nan
+    if isinstance(bias, dict):
+        return np.array([bias.get(w, np.nan) for w in vocab], dtype=np.float64)
+    return np.asarray(bias, dtype=np.float64)
+
+
+def neighbor_counts(words, idx, bias, neighbors, vocab):
+    
+    # words and neighbors without a bias label cannot be counted, as with the dict lookups this replaces
+    unlabelled = np.isnan(bias[idx])
+    if unlabelled.any():
+        raise KeyError(words[np.flatnonzero(unlabelled)[0]])
+    unlabelled = np.isnan(bias[neighbors])
+    if unlabelled.any():
+        raise KeyError(vocab[neighbors[unlabelled][0]])
+    
+    # count neighbors with positive (m) and non-positive (f) bias by gathering over the neighbor-index matrix
+    m = np.count_nonzero(bias[neighbors] > 0, axis=1)
+    
+    counts = np.zeros(len(words), dtype=NEIGHBOR_DTYPE)
+    counts['word'] = words
+    counts['bias'] = bias[idx]
+    counts['m'] = m
+    counts['f'] = neighbors.shape[1] - m
+    return counts
+
+
+def bias_by_neighbors(wv, w2i, vocab, gender_bias_bef, size, neighbours_num = 100):
+    
+    bias = bias_array(gender_bias_bef, vocab)
+    
+    if size > 0:
+        # the extremes are chosen among labelled words only, as when sorting the dict
+        labelled = np.flatnonzero(~np.isnan(bias))
+        female, male = extreme_words(bias[labelled], [vocab[i] for i in labelled], size, size)
+        selected = female + male
+    else:
+        selected = vocab
+    idx = np.array([w2i[w] for w in selected], dtype=np.int64)
+    neighbors = topK_batch(selected, wv, w2i, k=neighbours_num)
+    
+    return neighbor_counts(selected, idx, bias, neighbors, vocab)
 
 def get_tuples_prof(wv, w2i, vocab,  words, gender_bias_dict):
     
     wv = normalize(wv)
+    bias = bias_array(gender_bias_dict, vocab)
     
-    tuples = []
-    for w in words:
-        if w not in gender_bias_dict:
-            continue
-            
-        top = topK(w, wv, w2i, vocab, k=105)[:100]
-            
-        m = 0
-        f = 0  
-        for t in top:          
-            if gender_bias_dict[t] > 0:
-                m+=1
-            else:
-                f+=1
-                
-        tuples.append((w, gender_bias_dict[w], m, f))
+    words = [w for w in words if w in w2i and not np.isnan(bias[w2i[w]])]
+    idx = np.array([w2i[w] for w in words], dtype=np.int64)
+    neighbors = topK_batch(words, wv, w2i, k=100)
         
-    return tuples
+    return neighbor_counts(words, idx, bias, neighbors, vocab)
 
 # compute correlation between bias-by-projection and bias-by-neighbors
 
@@ -209,36 +473,49 @@ def pearson(a,b):
 
 def compute_corr(tuples, i1, i2):
     
-    a = []
-    b = []
-    for t in tuples:
-        a.append(t[i1])
-        b.append(t[i2])
+    # structured arrays from bias_by_neighbors are read by column, with i1 and i2 as positions or field names
+    if isinstance(tuples, np.ndarray) and tuples.dtype.names:
+        names = tuples.dtype.names
+        a = tuples[names[i1] if isinstance(i1, int) else i1]
+        b = tuples[names[i2] if isinstance(i2, int) else i2]
+    else:
+        a = [t[i1] for t in tuples]
+        b = [t[i2] for t in tuples]
     assert(len(a)==len(b))    
     print('pearson: ', scipy.stats.pearsonr(a,b))
     print('spearman: ', scipy.stats.spearmanr(a, b))
     
 # Auxiliary finctions
 
-from sklearn.cluster import KMeans
+from multiprocessing import Pool
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.manifold import TSNE
 
-def visualize(vectors, y_true, y_pred, ax, title, random_state, num_clusters = 2):
+def stratified_sample(y_true, y_pred, max_points, random_state):
     
-    # perform TSNE
+    # at most max_points indices, drawn from every (true, predicted) group in proportion to its size
+    groups = np.asarray(y_true)[:len(y_pred)] * 2 + np.asarray(y_pred)[:len(y_true)]
+    if max_points is None or len(groups) <= max_points:
+        return np.arange(len(groups))
+    rng = np.random.RandomState(random_state)
+    sample = [rng.choice(np.flatnonzero(groups == g), max(1, int(round(max_points * np.mean(groups == g)))), 
+                         replace=False)
+              for g in np.unique(groups)]
+    return np.sort(np.concatenate(sample))
+
+
+def visualize(vectors, y_true, y_pred, ax, title, random_state, num_clusters = 2, max_points = 5000):
     
-    X_embedded = TSNE(n_components=2, random_state=random_state).fit_transform(vectors)
-    for x,p,y in zip(X_embedded, y_pred, y_true):
-        if p:
-            if y:
-                ax.scatter(x[0], x[1], marker = '.', c = 'c')
-            else:
-                ax.scatter(x[0], x[1], marker = 'x', c = 'c')
-        else:
-            if y:
-                ax.scatter(x[0], x[1], marker = '.', c = 'darkviolet')
-            else:
-                ax.scatter(x[0], x[1], marker = 'x', c = 'darkviolet')
+    # perform TSNE on a stratified subsample of at most max_points points
+    idx = stratified_sample(y_true, y_pred, max_points, random_state)
+    y_true = np.asarray(y_true)[idx]
+    y_pred = np.asarray(y_pred)[idx]
+    
+    X_embedded = TSNE(n_components=2, random_state=random_state).fit_transform(np.asarray(vectors)[idx])
+    for p, color in [(1, 'c'), (0, 'darkviolet')]:
+        for y, marker in [(1, '.'), (0, 'x')]:
+            group = (y_pred == p) & (y_true == y)
+            ax.scatter(X_embedded[group, 0], X_embedded[group, 1], marker = marker, c = color)
                         
     
     ax.text(.01, .9, title ,transform=ax.transAxes, fontsize=15)
@@ -246,39 +523,174 @@ def visualize(vectors, y_true, y_pred, ax, title, random_state, num_clusters = 2
     
 def extract_vectors(words, wv, w2i):
     
+    if isinstance(wv, EmbeddingMatrix):
+        return wv.rows(words)
+    
     X = [wv[w2i[x],:] for x in words]
     
     return X
 
 
-def cluster_and_visualize(words, X, random_state, y_true, num=2):
+def cluster_precision(X, y_true, random_state, num=2, fast=False):
     
-    y_pred = KMeans(n_clusters=num, random_state=random_state).fit_predict(X)
+    # fast uses minibatch k-means, seeded by random_state like the full-batch KMeans
+    if fast:
+        y_pred = MiniBatchKMeans(n_clusters=num, random_state=random_state, batch_size=4096, n_init=3).fit_predict(X)
+    else:
+        y_pred = KMeans(n_clusters=num, random_state=random_state).fit_predict(X)
+    # like zip, compare only as many labels as both sides have
+    n = min(len(y_true), len(y_pred))
+    correct = np.mean(np.asarray(y_true[:n]) == y_pred[:n])
+    return max(correct, 1 - correct), y_pred
+
+
+def cluster_and_visualize(words, X, random_state, y_true, num=2, fast=False):
+    
+    preci, y_pred = cluster_precision(X, y_true, random_state, num, fast)
 #     fig, axs = plt.subplots(figsize=(6, 3))
 #     visualize(X, y_true, y_pred, axs, 'Original', random_state)
-    correct = [1 if item1 == item2 else 0 for (item1,item2) in zip(y_true, y_pred) ]
-    print('precision', max(sum(correct)/float(len(correct)), 1 - sum(correct)/float(len(correct))))
+    print('precision', preci)
+    return preci
+
+
+# Component sweep for Double-Hard Debias: the projections on the PCA components are computed once
+# and each candidate's debiased vectors are derived from them, so candidates are scored in parallel
+
+_sweep = {}
+
+def _init_sweep(base, proj, D, n_rows, w2i_def, definitional_pairs, y_true, random_state, fast):
+    
+    _sweep.update(base=base, proj=proj, D=D, n_rows=n_rows, w2i_def=w2i_def, definitional_pairs=definitional_pairs,
+                  y_true=y_true, random_state=random_state, fast=fast)
+
+
+def _subtract_outer(X, a, v, chunk_size=10000):
+    
+    # X -= outer(a, v) in place, in chunks of rows so no temporary of the size of X is made
+    for start in range(0, len(X), chunk_size):
+        X[start:start+chunk_size] -= np.outer(a[start:start+chunk_size], v)
+    return X
+
+
+def _sweep_candidate(j):
+    
+    # same vectors as hard_debias with component_ids=[component j]; base holds the clustered words
+    # followed by the definitional words, and is copied once and then updated in place
+    X = _subtract_outer(_sweep['base'].copy(), _sweep['proj'][:, j], _sweep['D'][j])
+    v = doPCA(_sweep['definitional_pairs'], X, _sweep['w2i_def']).components_[0]
+    X = X[:_sweep['n_rows']]
+    _subtract_outer(X, X.dot(v) / v.dot(v), v)
+    
+    preci, _ = cluster_precision(X, _sweep['y_true'], _sweep['random_state'], fast=_sweep['fast'])
+    return preci
+
 
+def component_sweep(wv, w2i, words, y_true, main_pca, wv_mean, definitional_pairs, component_ids=range(20),
+                    random_state=1, processes=4, fast=False):
     
+    # precision of clustering words after debiasing with each single component, as plotted in the notebook;
+    # every worker holds one copy of the words' vectors, so processes bounds the peak memory
+    def_words = list(dict.fromkeys(w for pair in definitional_pairs for w in pair if w in w2i))
+    w2i_def = {w: len(words) + i for i, w in enumerate(def_words)}
+    
+    U = np.asarray(wv[[w2i[w] for w in list(words) + def_words], :])
+    D = main_pca.components_[list(component_ids)]
+    base = U - wv_mean
+    proj = U.dot(D.T)
+    del U
+    
+    with Pool(processes, initializer=_init_sweep,
+              initargs=(base, proj, D, len(words), w2i_def, definitional_pairs, y_true, random_state, fast)) as pool:
+        precisions = pool.map(_sweep_candidate, range(len(D)))
+    
+    for component_id, preci in zip(component_ids, precisions):
+        print('component id: ', component_id, 'precision', preci)
+    return precisions
+
+    
+import time
 import scipy.stats
 from sklearn import svm
-def train_and_predict(wv, w2i, vocab, size_train, size_test, males, females):
+from sklearn.kernel_approximation import RBFSampler
+from sklearn.linear_model import SGDClassifier
+
+def make_classifier(mode, dim, n_components = None, random_state = 0):
+    
+    # 'svc' is the original RBF SVC; 'linear' and 'sgd' scale linearly with the number of words,
+    # optionally on random Fourier features approximating the same RBF kernel (gamma='auto' is 1/dim)
+    features = RBFSampler(gamma=1.0/dim, n_components=n_components, random_state=random_state) if n_components else None
+    if mode == 'svc':
+        clf = svm.SVC(gamma='auto')
+    elif mode == 'linear':
+        clf = svm.LinearSVC(dual=False)
+    elif mode == 'sgd':
+        clf = SGDClassifier(loss='hinge', alpha=1e-5, random_state=random_state)
+    else:
+        raise ValueError('unknown classifier mode: {}'.format(mode))
+    return clf, features
+
+
+def fit_classifier(clf, features, X, Y, mode, batch_size = 10000, n_epochs = 5, random_state = 0):
+    
+    if features is not None:
+        features.fit(X[:1])
+    if mode != 'sgd':
+        clf.fit(X if features is None else features.transform(X), Y)
+        return clf
+    
+    # minibatch training, featurizing one batch at a time
+    rng = np.random.RandomState(random_state)
+    for epoch in range(n_epochs):
+        order = rng.permutation(len(X))
+        for start in range(0, len(X), batch_size):
+            batch = order[start:start+batch_size]
+            Xb = X[batch] if features is None else features.transform(X[batch]).astype(np.float32)
+            clf.partial_fit(Xb, Y[batch], classes=[0, 1])
+    return clf
+
+
+def train_and_predict(wv, w2i, vocab, size_train, size_test, males, females, mode = 'svc', n_components = None,
+                      batch_size = 10000, random_state = 0):
     
-    X_train = [wv[w2i[w],:] for w in males[:size_train]+females[:size_train]]
-    Y_train = [1]*size_train + [0]*size_train
-    X_test = [wv[w2i[w],:] for w in males[size_train:]+females[size_train:]]
-    Y_test = [1]*size_test + [0]*size_test
+    X_train = np.asarray(wv[[w2i[w] for w in males[:size_train]+females[:size_train]], :], dtype=np.float32)
+    Y_train = np.array([1]*size_train + [0]*size_train)
+    X_test = np.asarray(wv[[w2i[w] for w in males[size_train:]+females[size_train:]], :], dtype=np.float32)
+    Y_test = np.array([1]*size_test + [0]*size_test)
 
-    clf = svm.SVC(gamma='auto')
-    clf.fit(X_train, Y_train)
+    clf, features = make_classifier(mode, X_train.shape[1], n_components, random_state)
+    start_time = time.time()
+    clf = fit_classifier(clf, features, X_train, Y_train, mode, batch_size, random_state=random_state)
+    fit_time = time.time() - start_time
 
-    preds = clf.predict(X_test)
+    preds = np.concatenate([clf.predict(X_test[i:i+batch_size] if features is None 
+                                        else features.transform(X_test[i:i+batch_size]))
+                            for i in range(0, len(X_test), batch_size)])
 
-    accuracy = [1 if y==z else 0 for y,z in zip(preds, Y_test)]
-    acc = float(sum(accuracy))/len(accuracy)
-    print('accuracy:', float(sum(accuracy))/len(accuracy))
+    acc = float(np.mean(preds[:len(Y_test)] == Y_test))
+    print('accuracy:', acc, 'fit time: {:.1f}s'.format(fit_time))
     
     return acc
+
+
+def classifier_tradeoff(wv, w2i, vocab, size_train, size_test, males, females, 
+                        modes = (('svc', None), ('linear', None), ('sgd', None), ('sgd', 2000)), svc_max_train = 5000):
+    
+    # fit time and accuracy of each (mode, n_components); the SVC is trained on at most svc_max_train words 
+    # per class since its cost grows roughly quadratically
+    results = []
+    for mode, n_components in modes:
+        n_train = min(size_train, svc_max_train) if mode == 'svc' else size_train
+        start_time = time.time()
+        acc = train_and_predict(wv, w2i, vocab, n_train, size_test, 
+                                males[:n_train] + males[size_train:size_train+size_test], 
+                                females[:n_train] + females[size_train:size_train+size_test], 
+                                mode=mode, n_components=n_components)
+        results.append((mode, n_components, n_train, time.time() - start_time, acc))
+    
+    print('mode\tfeatures\ttrain/class\ttime (s)\taccuracy')
+    for mode, n_components, n_train, elapsed, acc in results:
+        print('{}\t{}\t{}\t{:.1f}\t{:.4f}'.format(mode, n_components or '-', n_train, elapsed, acc))
+    return results
     
     
 # Auxiliary functions for experiments by Caliskan et al.
@@ -380,27 +792,111 @@ def effect_size(X, Y, A, B,  wv, w2i, vocab):
     return (norm_x-norm_y)/std
 
 
-def p_value_sample(X, Y, A, B, wv, w2i, vocab):
-    
-    random.seed(10)
-    np.random.seed(10)
-    all_s_words = {}
-    
+# Vectorized WEAT: all associations of a test come from one matrix product of unit vectors;
+# wv may carry a leading model axis, [models x vocab x dim] as in utils/stacked.py, and every score carries it too
+
+def unit_rows(words, wv, w2i):
+
+    X = np.asarray(wv[..., [w2i[w] for w in words], :], dtype=np.float64)
+    return X / LA.norm(X, axis=-1)[..., np.newaxis]
+
+
+def association_diffs(targets, A, B, wv, w2i):
+
+    # s(t, A, B) for every target word t, same as association_diff
+    sims = np.matmul(unit_rows(targets, wv, w2i), np.swapaxes(unit_rows(list(A) + list(B), wv, w2i), -1, -2))
+    return sims[..., :len(A)].mean(axis=-1) - sims[..., len(A):].mean(axis=-1)
+
+
+def effect_size_vec(X, Y, A, B, wv, w2i):
+
+    s = association_diffs(list(X) + list(Y), A, B, wv, w2i)
+    return (s[..., :len(X)].mean(axis=-1) - s[..., len(X):].mean(axis=-1)) / np.std(s, axis=-1, ddof=1)
+
+
+def weat_words(test, w2i):
+
+    # X, Y, A, B of a Responsibly-style WEAT test, without words missing from the vocabulary
+    keys = ['first_target', 'second_target', 'first_attribute', 'second_attribute']
+    return [[w for w in test[key]['words'] if w in w2i] for key in keys]
+
+
+def weat_scores(weat_data, wv, w2i):
+
+    # the words (X, Y, A, B) of every test with s(w, A, B) for X followed by Y and the effect size d:
+    # the rows of all words are gathered and normalized once and compared with a single matrix product
+    tests = [weat_words(test, w2i) for test in weat_data]
+    words = sorted(set(w for test in tests for group in test for w in group))
+    idx = {w: i for i, w in enumerate(words)}
+    U = unit_rows(words, wv, w2i)
+    sims = np.matmul(U, np.swapaxes(U, -1, -2))
+
+    scores = []
+    for X, Y, A, B in tests:
+        T = sims[..., [idx[w] for w in X + Y], :]
+        s = T[..., [idx[w] for w in A]].mean(axis=-1) - T[..., [idx[w] for w in B]].mean(axis=-1)
+        d = (s[..., :len(X)].mean(axis=-1) - s[..., len(X):].mean(axis=-1)) / np.std(s, axis=-1, ddof=1)
+        scores.append(((X, Y, A, B), s, d))
+    return scores
+
+
+def weat_effect_sizes(weat_data, wv, w2i):
+
+    # score every test of a WEAT json file (e.g. benchmark_weat.json, custom_weat.json) in one pass
+    results = []
+    for test, ((X, Y, A, B), s, d) in zip(weat_data, weat_scores(weat_data, wv, w2i)):
+        results.append({'Target words': test['first_target']['name'] + ' vs. ' + test['second_target']['name'],
+                        'Attrib. words': test['first_attribute']['name'] + ' vs. ' + test['second_attribute']['name'],
+                        'Nt': '{}x{}'.format(len(X), len(Y)),
+                        'Na': '{}x{}'.format(len(A), len(B)),
+                        's': s,
+                        'd': d})
+    return results
+
+
+def permutation_p_value(s, length, num_of_samples=1000000, batch_size=100000, seed=10, tol=None, z=1.96):
+
+    # s holds s(w, A, B) for X followed by Y; s_group of a split is then 2*sum(s[Xi]) - sum(s),
+    # so each permutation is scored by summing the s-values picked out by a row of an index matrix
+    s = np.asarray(s, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    s_orig = s[:length].sum()
+
+    larger = 0
+    total = 0
+    while total < num_of_samples:
+        batch = min(batch_size, num_of_samples - total)
+        Xi = np.argpartition(rng.random((batch, len(s))), length - 1, axis=1)[:, :length]
+        larger += int(np.count_nonzero(s[Xi].sum(axis=1) > s_orig))
+        total += batch
+
+        # early stopping once the confidence interval of the p-value is narrower than +-tol
+        if tol is not None:
+            p = (larger + 1) / float(total + 2)
+            if z * np.sqrt(p * (1 - p) / total) < tol:
+                break
+
+    return larger/float(total), total
+
+
+def p_value_sample(X, Y, A, B, wv, w2i, vocab, seed=10, tol=None):
+
     assert(len(X) == len(Y))
     length = len(X)
-    
-    s_orig = s_group(X, Y, A, B,  wv, w2i, vocab, all_s_words) 
-    
+
+    s = association_diffs(X + Y, A, B, wv, w2i)
+
     num_of_samples = min(1000000, int(scipy.special.comb(length*2,length)*100))
-    print('num of samples', num_of_samples)
-    larger = 0
-    for i in range(num_of_samples):
-        permute = np.random.permutation(X+Y)
-        Xi = permute[:length]
-        Yi = permute[length:]
-        if s_group(Xi, Yi, A, B, space, all_s_words) > s_orig:
-            larger += 1
-    
-    return larger/float(num_of_samples) 
-    
-    
\ No newline at end of file
+    p, total = permutation_p_value(s, length, num_of_samples, seed=seed, tol=tol)
+    print('num of samples', total)
+
+    return p
+
+
+def weat_p_values(results, num_of_samples=1000000, seed=10, tol=None):
+
+    # add permutation p-values to the tests scored by weat_effect_sizes, reusing their s-vectors
+    for r in results:
+        length = int(r['Nt'].split('x')[0])
+        r['p'], r['samples'] = permutation_p_value(r['s'], length, num_of_samples, seed=seed, tol=tol)
+    return results
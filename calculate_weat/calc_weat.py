@@ -1,93 +1,99 @@
 import datetime
 import json
+import os
+import resource
+from multiprocessing import Pool
 
 from utils import load_vectors
+from calculate_weat import weat_cache
 from responsibly.we import calc_all_weat
 
 
-# calculate weat scores using the benchmark files provided by Responsibly
-def calc_benchmark_scores(model, f_name):
-    with open('benchmark_weat.json') as data:
+# calculate weat scores for a json file of tests; given the model's path, results of unchanged tests
+# are reused from the cache and model may be a function that loads the model only when needed;
+# model_key is the model's content hash, if already computed
+def calc_scores(model, f_name, weat_file, with_original_finding, model_path=None, model_key=None):
+    with open(weat_file) as data:
         dict = json.load(data)
-    result = calc_all_weat(model, weat_data = dict, with_original_finding=True, with_pvalue=True)
+    if model_path is None:
+        result = calc_all_weat(model, weat_data = dict, with_original_finding=with_original_finding, with_pvalue=True)
+    else:
+        result = weat_cache.cached_calc_all_weat(model_path, model, dict, with_original_finding=with_original_finding,
+                                                 with_pvalue=True, model_key=model_key)
     result.to_csv(f_name)
 
+# the default test files live next to this module, so scoring works from any working directory
+WEAT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# calculate weat scores using the benchmark files provided by Responsibly
+def calc_benchmark_scores(model, f_name, weat_file=os.path.join(WEAT_DIR, 'benchmark_weat.json'), model_path=None,
+                          model_key=None):
+    calc_scores(model, f_name, weat_file, True, model_path, model_key)
+
 # calualte weat scores using the custom json file for political assocations
-def calc_custom_scores(model, f_name):
-    with open('custom_weat.json') as data:
-        dict = json.load(data)
-    result = calc_all_weat(model, weat_data = dict, with_original_finding=False, with_pvalue=True)
-    result.to_csv(f_name)
+def calc_custom_scores(model, f_name, weat_file=os.path.join(WEAT_DIR, 'custom_weat.json'), model_path=None,
+                       model_key=None):
+    calc_scores(model, f_name, weat_file, False, model_path, model_key)
 
-def main():
+SUITES = {'benchmark': calc_benchmark_scores, 'custom': calc_custom_scores}
+
+# models scored at once by default; each worker holds a whole model, so this bounds the peak memory
+PROCESSES = 4
+
+
+# score every suite requested for a single model, run inside a worker process;
+# the model is only loaded if some test is not already cached
+def score_model(job):
+    name, path, suites = job[:3]
+    fmt = job[3] if len(job) > 3 else None
     start_time = datetime.datetime.now()
-    #load w2v
-    w2v1_model = load_vectors.load_txt_format('../embeddings/Original/w2v/w2v1.txt')
-    w2v2_model = load_vectors.load_txt_format('../embeddings/Original/w2v/w2v2.txt')
-    w2v3_model = load_vectors.load_txt_format('../embeddings/Original/w2v/w2v3.txt')
-    w2v4_model = load_vectors.load_txt_format('../embeddings/Original/w2v/w2v4.txt')
-    w2v5_model = load_vectors.load_txt_format('../embeddings/Original/w2v/w2v5.txt')
-    print('done')
-
-    #load glove
-    glove1_model = load_vectors.load_txt_format('../embeddings/Original/GloVe/glove_vectors1.txt')
-    glove2_model = load_vectors.load_txt_format('../embeddings/Original/GloVe/glove_vectors2.txt')
-    glove3_model = load_vectors.load_txt_format('../embeddings/Original/GloVe/glove_vectors3.txt')
-    glove4_model = load_vectors.load_txt_format('../embeddings/Original/GloVe/glove_vectors4.txt')
-    glove5_model = load_vectors.load_txt_format('../embeddings/Original/GloVe/glove_vectors5.txt')
-    print('done')
-
-    #load fastText
-    fast_text1_model = load_vectors.load_txt_format('../embeddings/Original/fastText/fastText1.txt')
-    fast_text2_model = load_vectors.load_txt_format('../embeddings/Original/fastText/fastText2.txt')
-    fast_text3_model = load_vectors.load_txt_format('../embeddings/Original/fastText/fastText3.txt')
-    fast_text4_model = load_vectors.load_txt_format('../embeddings/Original/fastText/fastText4.txt')
-    fast_text5_model = load_vectors.load_txt_format('../embeddings/Original/fastText/fastText5.txt')
-    print('done')
-
-    #begin calculating weat benchmark scores
-    calc_benchmark_scores(w2v1_model.wv, 'weat_results/original/individual/w2v1_benchmark_weat.csv')
-    calc_benchmark_scores(w2v2_model.wv, 'weat_results/original/individual/w2v2_benchmark_weat.csv')
-    calc_benchmark_scores(w2v3_model.wv, 'weat_results/original/individual/w2v3_benchmark_weat.csv')
-    calc_benchmark_scores(w2v4_model.wv, 'weat_results/original/individual/w2v4_benchmark_weat.csv')
-    calc_benchmark_scores(w2v5_model.wv, 'weat_results/original/individual/w2v5_benchmark_weat.csv')
-    print('done')
-
-    calc_benchmark_scores(glove1_model, 'weat_results/original/individual/glove1_benchmark_weat.csv')
-    calc_benchmark_scores(glove2_model, 'weat_results/original/individual/glove2_benchmark_weat.csv')
-    calc_benchmark_scores(glove3_model, 'weat_results/original/individual/glove3_benchmark_weat.csv')
-    calc_benchmark_scores(glove4_model, 'weat_results/original/individual/glove4_benchmark_weat.csv')
-    calc_benchmark_scores(glove5_model, 'weat_results/original/individual/glove5_benchmark_weat.csv')
-    print('done')
-
-    calc_benchmark_scores(fast_text1_model.wv, 'weat_results/original/individual/fast_text1_benchmark_weat.csv')
-    calc_benchmark_scores(fast_text2_model.wv, 'weat_results/original/individual/fast_text2_benchmark_weat.csv')
-    calc_benchmark_scores(fast_text3_model.wv, 'weat_results/original/individual/fast_text3_benchmark_weat.csv')
-    calc_benchmark_scores(fast_text4_model.wv, 'weat_results/original/individual/fast_text4_benchmark_weat.csv')
-    calc_benchmark_scores(fast_text5_model.wv, 'weat_results/original/individual/fast_text5_benchmark_weat.csv')
-    print('done')
-
-    #begin calculating weat custom scores
-    calc_custom_scores(w2v1_model.wv, 'weat_results/debiased/individual/w2v1debiased_custom_weat.csv')
-    calc_custom_scores(w2v2_model.wv, 'weat_results/debiased/individual/w2v2debiased_custom_weat.csv')
-    calc_custom_scores(w2v3_model.wv, 'weat_results/debiased/individual/w2v3debiased_custom_weat.csv')
-    calc_custom_scores(w2v4_model.wv, 'weat_results/debiased/individual/w2v4debiased_custom_weat.csv')
-    calc_custom_scores(w2v5_model.wv, 'weat_results/debiased/individual/w2v5debiased_custom_weat.csv')
-    print('done')
-
-    calc_custom_scores(glove1_model, 'weat_results/debiased/individual/glove1debiased_custom_weat.csv')
-    calc_custom_scores(glove2_model, 'weat_results/debiased/individual/glove2debiased_custom_weat.csv')
-    calc_custom_scores(glove3_model, 'weat_results/debiased/individual/glove3debiased_custom_weat.csv')
-    calc_custom_scores(glove4_model, 'weat_results/debiased/individual/glove4debiased_custom_weat.csv')
-    calc_custom_scores(glove5_model, 'weat_results/debiased/individual/glove5debiased_custom_weat.csv')
-    print('done')
-
-    calc_custom_scores(fast_text1_model.wv, 'weat_results/debiased/individual/fastText1debiased_custom_weat.csv')
-    calc_custom_scores(fast_text2_model.wv, 'weat_results/debiased/individual/fastText2debiased_custom_weat.csv')
-    calc_custom_scores(fast_text3_model.wv, 'weat_results/debiased/individual/fastText3debiased_custom_weat.csv')
-    calc_custom_scores(fast_text4_model.wv, 'weat_results/debiased/individual/fastText4debiased_custom_weat.csv')
-    calc_custom_scores(fast_text5_model.wv, 'weat_results/debiased/individual/fastText5debiased_custom_weat.csv')
-    print('done')
+    loaded = {}
+
+    def load():
+        if 'model' not in loaded:
+            load_start = datetime.datetime.now()
+            loaded['model'] = load_vectors.load_model(path, fmt)
+            loaded['time'] = datetime.datetime.now() - load_start
+        return loaded['model']
+
+    # the model's files are hashed once for all of its suites
+    model_key = weat_cache.model_hash(path)
+
+    # a suite may name its own json file of tests as a third element
+    for suite, f_name, *weat_file in suites:
+        SUITES[suite](load, f_name, *weat_file, model_path=path, model_key=model_key)
+    load_time = loaded.get('time', datetime.timedelta(0))
+
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return name, load_time, datetime.datetime.now() - start_time, peak_rss
+
+# score a list of (name, model path, [(suite, output csv), ...][, format]) jobs across a process pool
+def run_models(jobs, processes=PROCESSES):
+    start_time = datetime.datetime.now()
+
+    # a fresh worker per model so each model is released as soon as it has been scored
+    with Pool(processes, maxtasksperchild=1) as pool:
+        for i, (name, load_time, total_time, peak_rss) in enumerate(pool.imap_unordered(score_model, jobs), 1):
+            print(f'[{i}/{len(jobs)}] {name}: loaded in {load_time}, done in {total_time}, '
+                  f'peak RSS {peak_rss:.0f} MB')
+
+    print('all models done in', datetime.datetime.now() - start_time)
+
+# build the jobs for every trial of a model family with its original benchmark and custom outputs
+def original_jobs(name, path_format, trials=range(1, 6)):
+    jobs = []
+    for i in trials:
+        suites = [('benchmark', f'weat_results/original/individual/{name}{i}_benchmark_weat.csv'),
+                  ('custom', f'weat_results/original/individual/{name}{i}_custom_weat.csv')]
+        jobs.append((f'{name}{i}', path_format.format(i), suites))
+    return jobs
+
+def main():
+    jobs = original_jobs('w2v', '../embeddings/Original/w2v/w2v{}.txt') \
+        + original_jobs('glove', '../embeddings/Original/GloVe/glove_vectors{}.txt') \
+        + original_jobs('fast_text', '../embeddings/Original/fastText/fastText{}.txt')
+    run_models(jobs)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
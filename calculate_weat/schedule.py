@@ -0,0 +1,87 @@
+import json
+import os
+import sys
+
+from utils import load_vectors
+from calculate_weat.calc_weat import PROCESSES, run_models
+from calculate_weat.weat_cache import model_files
+
+UNITS = {'KB': 2**10, 'MB': 2**20, 'GB': 2**30, 'TB': 2**40}
+
+# memory of a worker before it loads a model: the interpreter with pandas, Gensim, SciPy and Responsibly
+WORKER_OVERHEAD = 2**30
+
+
+# read a manifest listing models, their formats and the suites to score, from YAML or JSON; paths are
+# relative to the working directory, and a suite without weat_file uses the test file shipped with calc_weat:
+#
+#   memory_limit: 8GB          (optional)
+#   processes: 4               (optional)
+#   models:
+#     - name: w2v1
+#       path: ../embeddings/Original/w2v/w2v1.txt
+#       format: txt            (optional, inferred from the extension)
+#       suites:
+#         - {suite: benchmark, output: weat_results/original/individual/w2v1_benchmark_weat.csv}
+#         - {suite: custom, output: weat_results/original/individual/w2v1_custom_weat.csv, weat_file: calculate_weat/custom_weat.json}
+def read_manifest(file):
+    with open(file) as f:
+        if file.endswith(('.yaml', '.yml')):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+# parse sizes such as '8GB' or '512 MB' into bytes
+def parse_size(size):
+    if isinstance(size, (int, float)):
+        return int(size)
+    size = size.strip().upper()
+    for unit, factor in UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * factor)
+    return int(size)
+
+# estimate the memory a model takes once loaded as float32 KeyedVectors, plus its normalized copy
+def model_memory(path, fmt=None):
+    if path.endswith('.npy') or fmt == 'npy':
+        return os.path.getsize(path if path.endswith('.npy') else path + '.npy') * 2
+    if path.endswith('.txt') or fmt == 'txt':
+        rows, dim, _ = load_vectors.txt_shape(path)
+        return rows * dim * 4 * 2 + rows * 200
+    # Gensim saves large arrays to side files next to the model, such as <path>.wv.vectors.npy,
+    # and loads all of them, so every file counts
+    return sum(os.path.getsize(file) for file in model_files(path)) * 2
+
+# turn a manifest into runner jobs
+def manifest_jobs(manifest):
+    jobs = []
+    for model in manifest['models']:
+        suites = [(s['suite'], s['output'], s['weat_file']) if 'weat_file' in s else (s['suite'], s['output'])
+                  for s in model['suites']]
+        jobs.append((model['name'], model['path'], suites, model.get('format')))
+    return jobs
+
+# score every model of a manifest: each worker loads one model, runs all of its suites, writes the outputs
+# and exits, releasing the model; with a memory limit, only as many workers run as the largest model allows
+def run_manifest(file):
+    manifest = read_manifest(file)
+    jobs = manifest_jobs(manifest)
+    processes = manifest.get('processes')
+
+    if 'memory_limit' in manifest:
+        limit = parse_size(manifest['memory_limit'])
+        sizes = {job[0]: model_memory(job[1], job[3]) for job in jobs}
+        jobs.sort(key=lambda job: sizes[job[0]], reverse=True)
+        largest = max(sizes.values()) + WORKER_OVERHEAD
+        if largest > limit:
+            print(f'warning: a worker with the largest model needs about {largest / 2**30:.1f} GB, '
+                  f'over the memory limit')
+        processes = max(1, min(processes or os.cpu_count(), limit // largest))
+        print(f'{processes} model(s) at a time, a worker with the largest needs about {largest / 2**30:.1f} GB')
+
+    run_models(jobs, processes or PROCESSES)
+
+
+# usage, from the repository root: python -m calculate_weat.schedule calculate_weat/original_manifest.json
+if __name__ == "__main__":
+    run_manifest(sys.argv[1])
@@ -0,0 +1,106 @@
+import datetime
+import glob
+import hashlib
+import json
+import os
+import pickle
+import sys
+
+import pandas as pd
+from responsibly.we import calc_all_weat
+
+from Doube_Hard_Debias.double_hard_utils import update_hash
+
+CACHE_DIR = 'weat_cache'
+
+
+# the files holding a model: <prefix>.npy and <prefix>.vocab for .npy stores, given with or without
+# the extension as load_vectors.load_model accepts, otherwise the file and any side files Gensim
+# saved next to it, such as <path>.wv.vectors.npy
+def model_files(path):
+    prefix = path[:-len('.npy')] if path.endswith('.npy') else path
+    if path.endswith('.npy') or (not os.path.isfile(path) and os.path.isfile(prefix + '.npy')):
+        return [prefix + '.npy', prefix + '.vocab']
+    return [path] + sorted(glob.glob(glob.escape(path) + '.*'))
+
+# hash the content of every file of a model
+def model_hash(path):
+    h = hashlib.sha1()
+    for file in model_files(path):
+        update_hash(h, file)
+    return h.hexdigest()
+
+# hash a single WEAT test independently of key order in the json file
+def test_hash(test):
+    return hashlib.sha1(json.dumps(test, sort_keys=True).encode('utf-8')).hexdigest()
+
+def test_name(test):
+    return (test['first_target']['name'] + ' vs. ' + test['second_target']['name'] + ' / '
+            + test['first_attribute']['name'] + ' vs. ' + test['second_attribute']['name'])
+
+def entry_path(model_key, test, with_original_finding, with_pvalue):
+    key = f'{model_key}_{test_hash(test)}_{int(with_original_finding)}{int(with_pvalue)}'
+    return os.path.join(CACHE_DIR, key + '.pkl')
+
+def read_entry(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+# calc_all_weat with one cached result per (model content, test, options), so only new or edited tests
+# are scored; model is a loaded model or a function loading it, called only if something must be scored,
+# and model_key is the model's hash, computed here unless the caller already has it
+def cached_calc_all_weat(model_path, model, weat_data, with_original_finding=False, with_pvalue=True, model_key=None):
+    model_key = model_key or model_hash(model_path)
+    paths = [entry_path(model_key, test, with_original_finding, with_pvalue) for test in weat_data]
+    missing = [i for i, path in enumerate(paths) if not os.path.exists(path)]
+
+    if missing:
+        model = model() if callable(model) else model
+        result = calc_all_weat(model, weat_data=[weat_data[i] for i in missing],
+                               with_original_finding=with_original_finding, with_pvalue=with_pvalue)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # calc_all_weat returns one row per test, in the order of weat_data
+        for row, i in enumerate(missing):
+            entry = {'model': model_path, 'test': test_name(weat_data[i]),
+                     'options': {'with_original_finding': with_original_finding, 'with_pvalue': with_pvalue},
+                     'created': datetime.datetime.now(), 'result': result.iloc[[row]]}
+            with open(paths[i], 'wb') as f:
+                pickle.dump(entry, f)
+
+    print(f'{model_path}: {len(weat_data) - len(missing)} cached, {len(missing)} scored')
+    return pd.concat([read_entry(path)['result'] for path in paths]).reset_index(drop=True)
+
+
+# list cached entries whose model path or test name contains pattern
+def list_entries(pattern=''):
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    entries = []
+    for name in sorted(os.listdir(CACHE_DIR)):
+        path = os.path.join(CACHE_DIR, name)
+        entry = read_entry(path)
+        if pattern in entry['model'] or pattern in entry['test']:
+            entries.append((path, entry))
+    return entries
+
+# delete cached entries whose model path or test name contains pattern
+def clear(pattern=''):
+    entries = list_entries(pattern)
+    for path, _ in entries:
+        os.remove(path)
+    print(f'removed {len(entries)} cached results')
+
+
+# usage: python -m calculate_weat.weat_cache list|clear [pattern]
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    pattern = sys.argv[2] if len(sys.argv) > 2 else ''
+    if command == 'clear':
+        clear(pattern)
+        return
+    for path, entry in list_entries(pattern):
+        print(f"{entry['created']:%Y-%m-%d %H:%M}\t{entry['model']}\t{entry['test']}\t{entry['options']}")
+
+if __name__ == "__main__":
+    main()
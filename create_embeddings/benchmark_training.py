@@ -0,0 +1,87 @@
+import argparse
+import csv
+import datetime
+import itertools
+import os
+import resource
+from multiprocessing import Pool
+
+from callback_class import callback_log
+from fast_text import create_fastText
+from w2v import create_w2v
+
+MODELS = {'w2v': create_w2v, 'fastText': create_fastText}
+FIELDS = ['model', 'lines', 'workers', 'words', 'seconds', 'words_per_sec', 'mean_epoch_seconds', 'peak_rss_mb']
+
+
+# write the first n lines of the corpus to a separate file, reused between runs
+def corpus_slice(file, lines, out_dir):
+    out = os.path.join(out_dir, f'{os.path.basename(file)}.{lines}')
+    if not os.path.exists(out):
+        with open(file, 'rb') as f, open(out, 'wb') as o:
+            o.writelines(itertools.islice(f, lines))
+    return out
+
+# train one model inside a fresh worker process so its peak RSS is measured on its own
+def train_run(model, file, workers, size, window, iter):
+    log = callback_log()
+    start_time = datetime.datetime.now()
+    trained = MODELS[model](file, workers=workers, size=size, window=window, iter=iter, callbacks=[log])
+    seconds = (datetime.datetime.now() - start_time).total_seconds()
+
+    words = trained.corpus_total_words * iter
+    return {'words': words,
+            'seconds': round(seconds, 2),
+            'words_per_sec': round(words / sum(log.epoch_times)),
+            'mean_epoch_seconds': round(sum(log.epoch_times) / len(log.epoch_times), 2),
+            # ru_maxrss is reported in kilobytes on Linux
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)}
+
+# print words/sec, speedup and parallel efficiency against the fewest workers for each model and slice
+def scaling_table(rows):
+    print('model\tlines\tworkers\twords/sec\tspeedup\tefficiency\tepoch (s)\tpeak RSS (MB)')
+    for (model, lines), group in itertools.groupby(rows, key=lambda r: (r['model'], r['lines'])):
+        group = sorted(group, key=lambda r: r['workers'])
+        base = group[0]
+        for r in group:
+            speedup = r['words_per_sec'] / base['words_per_sec']
+            efficiency = speedup * base['workers'] / r['workers']
+            print(f"{model}\t{lines}\t{r['workers']}\t{r['words_per_sec']}\t{speedup:.2f}\t{efficiency:.2f}\t"
+                  f"{r['mean_epoch_seconds']}\t{r['peak_rss_mb']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure training throughput of word2vec and fastText')
+    parser.add_argument('corpus', help='cleaned corpus with one sentence per line')
+    parser.add_argument('--models', default='w2v,fastText')
+    parser.add_argument('--lines', default='100000,1000000', help='corpus slice sizes in lines')
+    parser.add_argument('--workers', default='1,2,4,8,16')
+    parser.add_argument('--size', type=int, default=300)
+    parser.add_argument('--window', type=int, default=6)
+    parser.add_argument('--iter', type=int, default=1)
+    parser.add_argument('--out', default='training_benchmark.csv')
+    parser.add_argument('--slice-dir', default='.')
+    args = parser.parse_args()
+
+    rows = []
+    write_header = not os.path.exists(args.out)
+    with open(args.out, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        if write_header:
+            writer.writeheader()
+
+        for model in args.models.split(','):
+            for lines in map(int, args.lines.split(',')):
+                file = corpus_slice(args.corpus, lines, args.slice_dir)
+                for workers in map(int, args.workers.split(',')):
+                    print(f'{model}: {lines} lines, {workers} workers')
+                    with Pool(1, maxtasksperchild=1) as pool:
+                        result = pool.apply(train_run, (model, file, workers, args.size, args.window, args.iter))
+                    row = dict(model=model, lines=lines, workers=workers, **result)
+                    writer.writerow(row)
+                    f.flush()
+                    rows.append(row)
+
+    scaling_table(rows)
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,133 @@
 import datetime
+import glob
+import json
+import os
+import re
+import resource
+import shutil
 
 from gensim.models.callbacks import CallbackAny2Vec
 
 #creates callback logs for Gensim training
 class callback_log(CallbackAny2Vec):
-    '''Output loss at each epoch'''
-    def __init__(self):
-        self.epoch = 1
+    '''Output loss at each epoch, optionally logging each epoch as JSON lines and checkpointing the model
+    every few epochs or after a time interval in seconds, keeping only the newest keep checkpoints'''
+    def __init__(self, checkpoint_dir=None, every=None, interval=None, log_file=None, start_epoch=1, keep=1):
+        self.epoch = start_epoch
         self.losses = []
         self.start_time = datetime.datetime.now()
+        self.epoch_times = []
+        self.checkpoint_dir = checkpoint_dir
+        self.every = every
+        self.interval = interval
+        self.log_file = log_file
+        self.last_loss = 0
+        self.last_checkpoint = self.start_time
+        self.keep = keep
+        # total epoch count and initial learning rate of the run, saved with each checkpoint;
+        # resume_training sets them, as train() overwrites both on the model when resuming
+        self.epochs = None
+        self.alpha = None
+
+    def on_train_begin(self, model):
+        if self.epochs is None:
+            self.epochs, self.alpha = model.epochs, model.alpha
 
     def on_epoch_begin(self, model):
         print(f'Epoch: {self.epoch}', end='\t')
+        self.epoch_start = datetime.datetime.now()
 
     def on_epoch_end(self, model):
-        print(datetime.datetime.now()-self.start_time)
-        self.epoch += 1
\ No newline at end of file
+        now = datetime.datetime.now()
+        print(now-self.start_time)
+        seconds = (now - self.epoch_start).total_seconds()
+        self.epoch_times.append(seconds)
+
+        # Gensim accumulates the loss over the whole train() call (only word2vec computes it)
+        loss = model.get_latest_training_loss() if hasattr(model, 'get_latest_training_loss') else 0
+        self.losses.append(loss - self.last_loss)
+        self.last_loss = loss
+
+        if self.log_file:
+            with open(self.log_file, 'a') as f:
+                f.write(json.dumps({'epoch': self.epoch, 'time': now.isoformat(), 'seconds': round(seconds, 2),
+                                    'words_per_sec': round(model.corpus_total_words / seconds),
+                                    'loss': self.losses[-1], 'rss_mb': round(current_rss() / 2**20)}) + '\n')
+
+        if self.checkpoint_dir and ((self.every and self.epoch % self.every == 0) or
+                                    (self.interval and (now - self.last_checkpoint).total_seconds() >= self.interval)):
+            self.checkpoint(model)
+            self.last_checkpoint = now
+        self.epoch += 1
+
+    # save the model after the current epoch, point latest.json at it, then delete older checkpoints
+    def checkpoint(self, model):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        path = os.path.join(self.checkpoint_dir, f'epoch{self.epoch}.model')
+        model.save(path)
+        latest = os.path.join(self.checkpoint_dir, 'latest.json')
+        with open(latest + '.tmp', 'w') as f:
+            json.dump({'path': path, 'epoch': self.epoch, 'epochs': self.epochs, 'alpha': self.alpha}, f)
+        os.replace(latest + '.tmp', latest)
+        self.prune()
+
+    # remove all but the newest keep checkpoints, with the side files Gensim saves next to each
+    def prune(self):
+        saved = sorted(int(m.group(1)) for m in (re.fullmatch(r'epoch(\d+)\.model', name)
+                                                 for name in os.listdir(self.checkpoint_dir)) if m)
+        for epoch in saved[:-max(1, self.keep)]:
+            path = os.path.join(self.checkpoint_dir, f'epoch{epoch}.model')
+            for file in [path] + glob.glob(glob.escape(path) + '.*'):
+                os.remove(file)
+
+
+# resident memory of this process in bytes, or its peak where /proc is not available
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# the contents of latest.json in a checkpoint directory, or None if there is no checkpoint
+def read_latest(checkpoint_dir):
+    latest = os.path.join(checkpoint_dir or '', 'latest.json')
+    if not checkpoint_dir or not os.path.exists(latest):
+        return None
+    with open(latest) as f:
+        return json.load(f)
+
+# the path and epoch of the latest checkpoint in a directory, or (None, 0) if there is none
+def latest_checkpoint(checkpoint_dir):
+    info = read_latest(checkpoint_dir)
+    return (info['path'], info['epoch']) if info else (None, 0)
+
+# delete a checkpoint directory once its run has been saved, so the next run starts from scratch
+def clear_checkpoints(checkpoint_dir):
+    if checkpoint_dir:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+# the total epoch count and initial learning rate of the run that saved the latest checkpoint
+def checkpoint_schedule(checkpoint_dir):
+    info = read_latest(checkpoint_dir)
+    return info['epochs'], info['alpha']
+
+# train the remaining epochs of a model loaded from a checkpoint, continuing the learning rate schedule
+# of a run of iter epochs starting at alpha; without alpha, the model is assumed never to have been resumed
+def resume_training(model, file, iter, done, callbacks, alpha=None):
+    if done >= iter:
+        # the run finished but was not saved and cleared; this is the finished model, not a new run
+        print(f'the checkpoint already has all {iter} epochs, returning it without training')
+        return model
+
+    alpha = alpha or model.alpha
+    for callback in callbacks:
+        if isinstance(callback, callback_log):
+            callback.epochs, callback.alpha = iter, alpha
+
+    start_alpha = alpha - (alpha - model.min_alpha) * done / iter
+    # train() also resets compute_loss unless it is passed again
+    model.train(corpus_file=file, epochs=iter - done, start_alpha=start_alpha, end_alpha=model.min_alpha,
+                compute_loss=getattr(model, 'compute_loss', False), total_examples=model.corpus_count,
+                total_words=model.corpus_total_words, callbacks=callbacks)
+    return model
@@ -1,5 +1,9 @@
 import string
+import itertools
+from collections import deque
+from multiprocessing import Pool
 from nltk.tokenize import word_tokenize, sent_tokenize
+from tqdm import tqdm
 import os
 from gensim import utils
 
@@ -34,25 +38,53 @@ def removeNonalphaOrNonnum(tokens):
             words.append(word)
     return words
 
+# clean a single raw sentence: tokenize, strip punctuation, lower case and keep alphabetic or numeric tokens
+def clean_line(line):
+    tokens = tokenize(line.decode('utf-8'))
+    tokens = removePunctuation(tokens)
+    tokens = lowerCase(tokens)
+    tokens = removeNonalphaOrNonnum(tokens)
+    return ' '.join(tokens)
+
+# clean a chunk of raw sentences inside a worker process, returning the chunk's size in bytes for progress
+def clean_chunk(lines):
+    return [clean_line(line) for line in lines], sum(len(line) for line in lines)
+
+# lazily read a file as chunks of raw lines so only a few chunks are ever held in memory
+def read_chunks(file, chunk_size):
+    with open(file, 'rb') as f:
+        while True:
+            chunk = list(itertools.islice(f, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+# clean a corpus of any size in a process pool, writing sentences in input order
+def clean_stream(in_file, out_file, processes=None, chunk_size=10000):
+    processes = processes or os.cpu_count()
+    # at most two chunks per worker are in flight, which bounds memory use
+    max_pending = 2 * processes
+    pending = deque()
+
+    with Pool(processes) as pool, open(out_file, 'w', encoding='utf-8') as out, \
+            tqdm(total=os.path.getsize(in_file), unit='B', unit_scale=True) as progress:
+
+        def write_next():
+            sentences, size = pending.popleft().get()
+            for s in sentences:
+                out.write(s + '\n')
+            progress.update(size)
+
+        for chunk in read_chunks(in_file, chunk_size):
+            pending.append(pool.apply_async(clean_chunk, (chunk,)))
+            if len(pending) >= max_pending:
+                write_next()
+        while pending:
+            write_next()
+
 def main():
-    clean_sentences = []
-
-    #read in training corpus as a list of sentences
-    with open('double_hard_data/temp_sentences.txt', 'rb') as file:
-        lines = file.readlines()
-
-    #creates tokens for each sentence and clean
-    for line in lines:
-        tokens = tokenize(line.decode('utf-8'))
-        tokens = removePunctuation(tokens)
-        tokens = lowerCase(tokens)
-        tokens = removeNonalphaOrNonnum(tokens)
-        clean_sentences.append(' '.join(tokens))
-
-    #write each sentence token to a new line in a file
-    with open('../gloveTut/glove/clean_sent.txt', 'w') as file:
-        for s in clean_sentences:
-            file.write(s + '\n')
+    #read in training corpus, clean each sentence and write each sentence to a new line in a file
+    clean_stream('double_hard_data/temp_sentences.txt', '../gloveTut/glove/clean_sent.txt')
 
 
 if __name__ == "__main__":
@@ -1,15 +1,31 @@
 from gensim.models.fasttext import FastText
 from clean_corpus import corpus
 import datetime
-from callback_class import callback_log
+from callback_class import callback_log, clear_checkpoints, latest_checkpoint, checkpoint_schedule, resume_training
 
-#Create fastText model from a training corpus with custom settings
-def create_fastText(file):
-    fast_model = FastText(size=300, window=6, min_count=10, workers=8, negative=5, iter=10)
+#Settings of our fastText models, also used for each trial in trials.py
+FASTTEXT_SETTINGS = dict(size=300, window=6, min_count=10, negative=5, iter=10)
+
+#Create fastText model from a training corpus with custom settings,
+#checkpointing every few epochs and resuming from the latest checkpoint in checkpoint_dir
+def create_fastText(file, workers=8, size=FASTTEXT_SETTINGS['size'], window=FASTTEXT_SETTINGS['window'],
+                    iter=FASTTEXT_SETTINGS['iter'], callbacks=None, checkpoint_dir=None, every=1, interval=None,
+                    log_file=None):
+    path, done = latest_checkpoint(checkpoint_dir)
+    callbacks = callbacks or [callback_log(checkpoint_dir, every, interval, log_file, start_epoch=done + 1)]
+    if path:
+        print(f'resuming from {path} after epoch {done}')
+        iter, alpha = checkpoint_schedule(checkpoint_dir)
+        return verify(resume_training(FastText.load(path), file, iter, done, callbacks, alpha))
+
+    fast_model = FastText(workers=workers, **dict(FASTTEXT_SETTINGS, size=size, window=window, iter=iter))
     fast_model.build_vocab(corpus_file=file)
-    fast_model.train(corpus_file=file, epochs=fast_model.epochs, callbacks=[callback_log()],
+    fast_model.train(corpus_file=file, epochs=fast_model.epochs, callbacks=callbacks,
                      total_examples=fast_model.corpus_count, total_words=fast_model.corpus_total_words)
+    return verify(fast_model)
 
+#Verify vocabulary size and first ten words of a trained model
+def verify(fast_model):
     #Verify vocabulary size and first ten words
     for index, word in enumerate(fast_model.wv.index2word):
         if index == 10:
@@ -19,8 +35,10 @@ def create_fastText(file):
     return fast_model
 
 def main():
-    fast_text_model = create_fastText('double_hard_data/clean_sent.txt')
+    fast_text_model = create_fastText('double_hard_data/clean_sent.txt', checkpoint_dir='fast_text_vectors5_checkpoints',
+                                      log_file='fast_text_vectors5_epochs.jsonl')
     fast_text_model.save('fast_text_vectors5')
+    clear_checkpoints('fast_text_vectors5_checkpoints')
 
 if __name__ == "__main__":
     start_time = datetime.datetime.now()
@@ -0,0 +1,112 @@
+import sys
+from collections import Counter
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from gensim import utils
+from tqdm import tqdm
+
+# Pre-tokenized corpus: <prefix>.ids.npy holds every token as a uint32 vocabulary id, <prefix>.offsets.npy
+# holds where each sentence starts (plus the total length) and <prefix>.vocab lists the words, most frequent
+# first, as "word count" lines. Sentences are tokenized once, the same way as clean_corpus.corpus.
+
+
+# tokenize a cleaned corpus once and write it as memory-mappable token ids
+def encode_corpus(file, out_prefix, min_count=1):
+    # first pass: word counts and sizes, so the output arrays can be allocated up front
+    counts = Counter()
+    n_sentences = 0
+    with open(file, 'rb') as f:
+        for line in tqdm(f, desc='counting'):
+            counts.update(utils.simple_preprocess(line))
+            n_sentences += 1
+
+    vocab = [w for w, c in counts.most_common() if c >= min_count]
+    w2i = {w: i for i, w in enumerate(vocab)}
+    n_tokens = sum(counts[w] for w in vocab)
+
+    ids = open_memmap(out_prefix + '.ids.npy', mode='w+', dtype=np.uint32, shape=(n_tokens,))
+    offsets = np.zeros(n_sentences + 1, dtype=np.uint64)
+
+    # second pass: write the ids of the words kept in the vocabulary
+    pos = 0
+    with open(file, 'rb') as f:
+        for i, line in enumerate(tqdm(f, desc='encoding', total=n_sentences)):
+            sent = [w2i[w] for w in utils.simple_preprocess(line) if w in w2i]
+            ids[pos:pos + len(sent)] = sent
+            pos += len(sent)
+            offsets[i + 1] = pos
+
+    ids.flush()
+    np.save(out_prefix + '.offsets.npy', offsets)
+    with open(out_prefix + '.vocab', 'w', encoding='utf-8') as f:
+        for w in vocab:
+            f.write(f'{w} {counts[w]}\n')
+    print(f'{n_sentences} sentences, {n_tokens} tokens, {len(vocab)} words')
+
+
+#An iterator over a corpus written by encode_corpus, yielding sentences (lists of str) for Gensim
+class token_corpus:
+    def __init__(self, prefix):
+        self.ids = np.load(prefix + '.ids.npy', mmap_mode='r')
+        self.offsets = np.load(prefix + '.offsets.npy')
+        self.vocab = []
+        self.counts = []
+        with open(prefix + '.vocab', encoding='utf-8') as f:
+            for line in f:
+                word, count = line.rsplit(' ', 1)
+                self.vocab.append(word)
+                self.counts.append(int(count))
+        self.counts = np.array(self.counts, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # the token ids of each sentence, as views into the memory map without copying
+    def id_sentences(self):
+        for start, end in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.ids[start:end]
+
+    def __iter__(self):
+        vocab = self.vocab
+        for sent in self.id_sentences():
+            yield [vocab[i] for i in sent]
+
+    # number of occurrences of each vocabulary id, counted in chunks of the id array
+    def token_counts(self, chunk=2**26):
+        counts = np.zeros(len(self.vocab), dtype=np.int64)
+        for start in range(0, len(self.ids), chunk):
+            counts += np.bincount(self.ids[start:start + chunk], minlength=len(self.vocab))
+        return counts
+
+    # co-occurrence counts of the target words with every vocabulary word within window tokens,
+    # not crossing sentence boundaries, as a (targets x vocab) matrix
+    def cooccurrence(self, targets, window=6, chunk=2**24):
+        row = np.full(len(self.vocab), -1, dtype=np.int64)
+        row[np.asarray(targets)] = np.arange(len(targets))
+        cooc = np.zeros(len(targets) * len(self.vocab), dtype=np.int64)
+
+        # chunks overlap by window tokens so pairs spanning two chunks are counted once
+        for start in range(0, len(self.ids), chunk):
+            end = min(len(self.ids), start + chunk + window)
+            ids = np.asarray(self.ids[start:end], dtype=np.int64)
+            sent = np.searchsorted(self.offsets, np.arange(start, end), side='right')
+            pairs = []
+            for d in range(1, window + 1):
+                n = min(chunk, len(ids) - d)
+                if n <= 0:
+                    break
+                left, right = ids[:n], ids[d:d + n]
+                same = sent[:n] == sent[d:d + n]
+                for a, b in ((left, right), (right, left)):
+                    r = row[a]
+                    keep = same & (r >= 0)
+                    pairs.append(r[keep] * len(self.vocab) + b[keep])
+            if pairs:
+                cooc += np.bincount(np.concatenate(pairs), minlength=len(cooc))
+        return cooc.reshape(len(targets), len(self.vocab))
+
+
+# usage: python token_corpus.py clean_sent.txt clean_sent
+if __name__ == "__main__":
+    encode_corpus(sys.argv[1], sys.argv[2])
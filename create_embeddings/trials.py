@@ -0,0 +1,111 @@
+import argparse
+import datetime
+import json
+import os
+
+import numpy as np
+from gensim.models.word2vec import Word2Vec
+from gensim.models.fasttext import FastText
+from multiprocessing import Pool
+
+from callback_class import callback_log, clear_checkpoints, latest_checkpoint, checkpoint_schedule, resume_training
+from fast_text import FASTTEXT_SETTINGS
+from w2v import W2V_SETTINGS
+
+MODELS = {'w2v': (Word2Vec, W2V_SETTINGS), 'fast_text': (FastText, FASTTEXT_SETTINGS)}
+
+
+# the corpus a vocabulary was built from, identified by its path, size and modification time
+def corpus_stamp(file):
+    stat = os.stat(file)
+    return {'corpus': os.path.abspath(file), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+# scan the corpus once and save an untrained model holding the vocabulary and word counts;
+# a saved vocabulary is reused only while the corpus it was built from is unchanged
+def build_shared_vocab(kind, file, out_dir, workers):
+    path = os.path.join(out_dir, f'{kind}_vocab.model')
+    stamp_path = path + '.corpus.json'
+    if os.path.exists(path) and os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            if json.load(f) == corpus_stamp(file):
+                return path
+        print(f'{file} changed since {path} was built, scanning it again')
+    model_class, params = MODELS[kind]
+    model = model_class(workers=workers, **params)
+    start_time = datetime.datetime.now()
+    model.build_vocab(corpus_file=file)
+    print(f'{kind} vocabulary of {len(model.wv.vocab)} words built in {datetime.datetime.now() - start_time}')
+    os.makedirs(out_dir, exist_ok=True)
+    model.save(path)
+    with open(stamp_path, 'w') as f:
+        json.dump(corpus_stamp(file), f)
+    return path
+
+# train one trial from the saved vocabulary, with its own seed for the initial weights
+def train_trial(kind, vocab_path, file, seed, workers, out_path):
+    model_class, _ = MODELS[kind]
+    checkpoint_dir = out_path + '_checkpoints'
+    path, done = latest_checkpoint(checkpoint_dir)
+    callbacks = [callback_log(checkpoint_dir, every=1, log_file=out_path + '_epochs.jsonl', start_epoch=done + 1)]
+    start_time = datetime.datetime.now()
+
+    if path:
+        # the model's own epochs and alpha were overwritten by the train() call that saved the checkpoint
+        epochs, alpha = checkpoint_schedule(checkpoint_dir)
+        model = model_class.load(path)
+        model.workers = workers
+        resume_training(model, file, epochs, done, callbacks, alpha)
+    else:
+        model = model_class.load(vocab_path)
+        model.workers = workers
+        model.seed = seed
+        model.random = np.random.RandomState(seed)
+        model.trainables.seed = seed
+        model.trainables.prepare_weights(model.hs, model.negative, model.wv, vocabulary=model.vocabulary)
+        # train() resets compute_loss unless it is passed again
+        model.train(corpus_file=file, epochs=model.epochs, total_examples=model.corpus_count,
+                    total_words=model.corpus_total_words, compute_loss=getattr(model, 'compute_loss', False),
+                    callbacks=callbacks)
+
+    model.save(out_path)
+    clear_checkpoints(checkpoint_dir)
+    return out_path, datetime.datetime.now() - start_time
+
+def train_job(job):
+    return train_trial(*job)
+
+# train every trial of every model kind, running max_concurrent trials at once
+# and splitting the machine's cores between them
+def run_trials(file, kinds=('w2v', 'fast_text'), trials=range(1, 6), max_concurrent=2, cores=None, out_dir='.'):
+    cores = cores or os.cpu_count()
+    workers = max(1, cores // max_concurrent)
+
+    jobs = []
+    for kind in kinds:
+        vocab_path = build_shared_vocab(kind, file, out_dir, cores)
+        for i in trials:
+            jobs.append((kind, vocab_path, file, i, workers, os.path.join(out_dir, f'{kind}_vectors{i}')))
+
+    print(f'{len(jobs)} trials, {max_concurrent} at a time with {workers} workers each')
+    with Pool(max_concurrent, maxtasksperchild=1) as pool:
+        # trials are handed out one at a time, so a freed slot immediately starts the next trial
+        for out_path, elapsed in pool.imap_unordered(train_job, jobs):
+            print(f'{out_path} trained in {elapsed}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Train several seeded trials from one vocabulary scan')
+    parser.add_argument('corpus', nargs='?', default='double_hard_data/clean_sent.txt')
+    parser.add_argument('--models', default='w2v,fast_text')
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--max-concurrent', type=int, default=2)
+    parser.add_argument('--cores', type=int, default=None)
+    parser.add_argument('--out-dir', default='.')
+    args = parser.parse_args()
+    run_trials(args.corpus, args.models.split(','), range(1, args.trials + 1), args.max_concurrent,
+               args.cores, args.out_dir)
+
+if __name__ == "__main__":
+    start_time = datetime.datetime.now()
+    main()
+    end_time = datetime.datetime.now()
+    print(end_time - start_time)
@@ -1,12 +1,24 @@
 from gensim.models.word2vec import Word2Vec
 from clean_corpus import corpus
-from callback_class import callback_log
+from callback_class import callback_log, clear_checkpoints, latest_checkpoint, checkpoint_schedule, resume_training
 import datetime
 
-#Create word2vec model from a training corpus with custom settings
-def create_w2v(file):
-    model = Word2Vec(corpus_file=file, size=300, window=6, min_count=10, workers=8, negative=5, sg=1,
-                     iter=10, callbacks=[callback_log()])
+#Settings of our word2vec models, also used for each trial in trials.py
+W2V_SETTINGS = dict(size=300, window=6, min_count=10, negative=5, sg=1, iter=10, compute_loss=True)
+
+#Create word2vec model from a training corpus with custom settings,
+#checkpointing every few epochs and resuming from the latest checkpoint in checkpoint_dir
+def create_w2v(file, workers=8, size=W2V_SETTINGS['size'], window=W2V_SETTINGS['window'], iter=W2V_SETTINGS['iter'],
+               callbacks=None, checkpoint_dir=None, every=1, interval=None, log_file=None):
+    path, done = latest_checkpoint(checkpoint_dir)
+    callbacks = callbacks or [callback_log(checkpoint_dir, every, interval, log_file, start_epoch=done + 1)]
+    if path:
+        print(f'resuming from {path} after epoch {done}')
+        iter, alpha = checkpoint_schedule(checkpoint_dir)
+        model = resume_training(Word2Vec.load(path), file, iter, done, callbacks, alpha)
+    else:
+        settings = dict(W2V_SETTINGS, size=size, window=window, iter=iter)
+        model = Word2Vec(corpus_file=file, workers=workers, callbacks=callbacks, **settings)
     wv = model.wv
 
     #Verify vocabulary size and first ten words
@@ -19,8 +31,9 @@ def create_w2v(file):
 
 def main():
     corpus_file = 'double_hard_data/clean_sent.txt'
-    w2v_model = create_w2v(corpus_file)
+    w2v_model = create_w2v(corpus_file, checkpoint_dir='w2v_vectors5_checkpoints', log_file='w2v_vectors5_epochs.jsonl')
     w2v_model.save('w2v_vectors5')
+    clear_checkpoints('w2v_vectors5_checkpoints')
 
 if __name__ == "__main__":
     start_time = datetime.datetime.now()
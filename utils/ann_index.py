@@ -0,0 +1,165 @@
+import sys
+import datetime
+
+import numpy as np
+
+import load_vectors
+
+
+# normalize rows to unit length so dot products are cosine similarities
+def unit(X):
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=1)
+    norms[norms == 0] = 1
+    return X / norms[:, np.newaxis]
+
+# assign each row to its closest centroid, by cosine (spherical) or euclidean distance, in chunks
+def assign(X, C, spherical=True, chunk=65536):
+    labels = np.zeros(len(X), dtype=np.int64)
+    c_norms = (C ** 2).sum(axis=1)
+    for start in range(0, len(X), chunk):
+        sim = X[start:start+chunk].dot(C.T)
+        if spherical:
+            labels[start:start+chunk] = sim.argmax(axis=1)
+        else:
+            labels[start:start+chunk] = (c_norms - 2 * sim).argmin(axis=1)
+    return labels
+
+# plain Lloyd k-means in NumPy, seeded with k random rows
+def kmeans(X, k, n_iter=10, seed=0, spherical=True):
+    rng = np.random.default_rng(seed)
+    C = X[rng.choice(len(X), k, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = assign(X, C, spherical)
+        sums = np.zeros(C.shape, dtype=np.float64)
+        np.add.at(sums, labels, X)
+        counts = np.bincount(labels, minlength=k)
+        # empty clusters keep their previous centroid
+        filled = counts > 0
+        C[filled] = sums[filled] / counts[filled, np.newaxis]
+        if spherical:
+            C = unit(C)
+    return C
+
+
+# Inverted-file (IVF) index over unit vectors with optional product quantization (PQ).
+# Each vector is filed under its closest coarse centroid; a query only scores the vectors
+# in its n_probe closest lists, either exactly or from the PQ codes.
+class IVFIndex:
+
+    def __init__(self, centroids, order, offsets, codebooks=None, codes=None, vectors=None, n_probe=16):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.codebooks = codebooks
+        self.codes = codes
+        self.vectors = vectors
+        self.n_probe = n_probe
+
+    # build an index over wv; pq_m splits each vector into pq_m sub-vectors coded with one byte each
+    @classmethod
+    def build(cls, wv, n_lists=1024, n_probe=16, pq_m=None, n_iter=10, sample=100000, seed=0):
+        X = unit(wv)
+        rng = np.random.default_rng(seed)
+        train = X[rng.choice(len(X), min(sample, len(X)), replace=False)]
+
+        centroids = kmeans(train, n_lists, n_iter, seed)
+        labels = assign(X, centroids)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))])
+
+        codebooks = None
+        codes = None
+        if pq_m:
+            sub = np.split(np.arange(X.shape[1]), pq_m)
+            codebooks = np.stack([kmeans(train[:, s], 256, n_iter, seed, spherical=False) for s in sub])
+            codes = np.stack([assign(X[:, s], codebooks[j], spherical=False) for j, s in enumerate(sub)],
+                             axis=1).astype(np.uint8)
+
+        return cls(centroids, order, offsets, codebooks, codes, X, n_probe)
+
+    def save(self, file):
+        arrays = {'centroids': self.centroids, 'order': self.order, 'offsets': self.offsets}
+        if self.codes is not None:
+            arrays.update(codebooks=self.codebooks, codes=self.codes)
+        np.savez(file, **arrays)
+
+    # load a saved index; exact scoring needs the vectors, a PQ index answers from its codes
+    # and never normalizes a copy of them
+    @classmethod
+    def load(cls, file, wv=None, n_probe=16):
+        data = np.load(file)
+        vectors = unit(wv) if wv is not None and 'codes' not in data else None
+        return cls(data['centroids'], data['order'], data['offsets'],
+                   data['codebooks'] if 'codes' in data else None,
+                   data['codes'] if 'codes' in data else None,
+                   vectors, n_probe)
+
+    # score candidate rows for one query, from PQ codes when present, otherwise exactly
+    def score(self, q, candidates):
+        if self.codes is None:
+            return self.vectors[candidates].dot(q)
+        sub = np.split(q, len(self.codebooks))
+        table = np.stack([cb.dot(s) for cb, s in zip(self.codebooks, sub)])
+        return table[np.arange(len(sub)), self.codes[candidates]].sum(axis=1)
+
+    # return the (ids, scores) of the approximate k nearest neighbors of each query row
+    def search(self, queries, k=10, n_probe=None):
+        Q = unit(np.atleast_2d(queries))
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        probes = np.argpartition(-Q.dot(self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+
+        ids = np.full((len(Q), k), -1, dtype=np.int64)
+        scores = np.full((len(Q), k), -np.inf, dtype=np.float32)
+        for i, q in enumerate(Q):
+            candidates = np.concatenate([self.order[self.offsets[l]:self.offsets[l+1]] for l in probes[i]])
+            sim = self.score(q, candidates)
+            n = min(k, len(candidates))
+            best = np.argpartition(-sim, n - 1)[:n]
+            best = best[np.argsort(-sim[best])]
+            ids[i, :n] = candidates[best]
+            scores[i, :n] = sim[best]
+        return ids, scores
+
+    # recall@k of the index against exact search for a random sample of vocabulary words;
+    # the exact neighbors are found for batch queries at a time to bound the similarity matrix
+    def recall(self, wv, k=10, n_queries=1000, seed=0, batch=64):
+        X = unit(wv)
+        rng = np.random.default_rng(seed)
+        queries = rng.choice(len(X), min(n_queries, len(X)), replace=False)
+
+        start_time = datetime.datetime.now()
+        approx, _ = self.search(X[queries], k)
+        elapsed = datetime.datetime.now() - start_time
+
+        exact = np.zeros((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), batch):
+            dist = X[queries[start:start+batch]].dot(X.T)
+            np.negative(dist, out=dist)
+            exact[start:start+batch] = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approx, exact))
+        recall = hits / float(len(queries) * k)
+        print(f'recall@{k}: {recall:.4f}, {elapsed.total_seconds() * 1000 / len(queries):.2f} ms per query')
+        return recall
+
+
+# build and save an index next to vectors stored by load_vectors.convert_txt_to_npy
+def build_index(prefix, pq_m=None, **kwargs):
+    wv, _, _ = load_vectors.load_npy_arrays(prefix)
+    index = IVFIndex.build(wv, pq_m=pq_m, **kwargs)
+    index.save(prefix + '.ivf.npz')
+    index.recall(wv)
+    return index
+
+# load the index saved next to vectors stored by load_vectors.convert_txt_to_npy;
+# the vectors are only opened for an index without PQ codes
+def load_index(prefix, wv=None, n_probe=16):
+    file = prefix + '.ivf.npz'
+    if wv is None and 'codes' not in np.load(file):
+        wv, _, _ = load_vectors.load_npy_arrays(prefix)
+    return IVFIndex.load(file, wv, n_probe)
+
+
+# usage: python ann_index.py vectors [pq_m]
+if __name__ == "__main__":
+    build_index(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None)
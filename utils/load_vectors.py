@@ -1,4 +1,9 @@
+import sys
+
+import numpy as np
+from numpy.lib.format import open_memmap
 from gensim.models import KeyedVectors, Word2Vec, FastText
+from gensim.models.keyedvectors import Vocab
 
 # load word vectors from text files with the word followed by the vector on each line
 def load_txt_format(file):
@@ -10,4 +15,98 @@ def load_w2v(file):
 
 # load word vectors from Gensim files for fastText
 def load_fast_text(file):
-    return FastText.load(file)
\ No newline at end of file
+    return FastText.load(file)
+
+
+# find the number of vectors and their dimension in a text file, with or without a word2vec header line;
+# only a file without a header is read to the end to count its lines
+def txt_shape(file):
+    with open(file, encoding='utf-8') as f:
+        first = f.readline().rstrip('\n').split(' ')
+        if len(first) == 2:
+            return int(first[0]), int(first[1]), True
+        rows = sum(1 for _ in f)
+    return rows + 1, len(first) - 1, False
+
+# write a vocabulary with one word on each line
+def write_vocab(vocab, file):
+    with open(file, 'w', encoding='utf-8', newline='') as f:
+        for w in vocab:
+            f.write(w + '\n')
+
+# read a vocabulary written by write_vocab
+def read_vocab(file):
+    with open(file, encoding='utf-8', newline='') as f:
+        return f.read().split('\n')[:-1]
+
+# convert a text file of word vectors into a float32 .npy matrix and a .vocab file, done once per model
+def convert_txt_to_npy(file, out_prefix):
+    rows, dim, has_header = txt_shape(file)
+    wv = open_memmap(out_prefix + '.npy', mode='w+', dtype=np.float32, shape=(rows, dim))
+    vocab = []
+
+    with open(file, encoding='utf-8') as f:
+        if has_header:
+            f.readline()
+        for i, line in enumerate(f):
+            word, vec = line.rstrip('\n').split(' ', 1)
+            vocab.append(word)
+            wv[i, :] = np.array(vec.split(), dtype=np.float32)
+
+    wv.flush()
+    del wv
+    write_vocab(vocab, out_prefix + '.vocab')
+    print(len(vocab), (rows, dim))
+
+# open vectors written by convert_txt_to_npy as a read-only memory map, shared between processes,
+# and return them as the (wv, w2i, vocab) triple used by double_hard_utils
+def load_npy_arrays(prefix, mmap_mode='r'):
+    wv = np.load(prefix + '.npy', mmap_mode=mmap_mode)
+    vocab = read_vocab(prefix + '.vocab')
+    w2i = {w: i for i, w in enumerate(vocab)}
+    return wv, w2i, vocab
+
+# open vectors written by convert_txt_to_npy as Gensim KeyedVectors backed by the memory map
+def load_npy_format(prefix):
+    wv, _, vocab = load_npy_arrays(prefix)
+    model = KeyedVectors(wv.shape[1])
+    model.vectors = wv
+    model.index2word = vocab
+    # counts follow load_word2vec_format, which ranks words by their position in the file
+    model.vocab = {w: Vocab(index=i, count=len(vocab) - i) for i, w in enumerate(vocab)}
+    return model
+
+# load any supported model as KeyedVectors, inferring the format from the file extension if not given
+def load_model(file, fmt=None):
+    if fmt is None:
+        fmt = 'npy' if file.endswith('.npy') else 'txt' if file.endswith('.txt') else 'w2v'
+    if fmt == 'npy':
+        return load_npy_format(file[:-len('.npy')] if file.endswith('.npy') else file)
+    if fmt == 'txt':
+        return load_txt_format(file)
+    if fmt == 'w2v':
+        return load_w2v(file).wv
+    if fmt == 'fast_text':
+        return load_fast_text(file).wv
+    raise ValueError(f'unknown embedding format: {fmt}')
+
+# read only the vocabulary of a model in any supported format, without parsing any vectors
+def load_vocab(file, fmt=None):
+    if fmt is None:
+        fmt = 'npy' if file.endswith('.npy') else 'txt' if file.endswith('.txt') else 'w2v'
+    if fmt == 'npy':
+        return read_vocab((file[:-len('.npy')] if file.endswith('.npy') else file) + '.vocab')
+    if fmt == 'txt':
+        with open(file, encoding='utf-8') as f:
+            first = f.readline().rstrip('\n').split(' ')
+            vocab = [] if len(first) == 2 else [first[0]]
+            vocab.extend(line.split(' ', 1)[0] for line in f)
+        return vocab
+    # the vectors of Gensim models are memory-mapped, so they are never read from disk
+    model_class = FastText if fmt == 'fast_text' else Word2Vec
+    return model_class.load(file, mmap='r').wv.index2word
+
+
+# usage: python load_vectors.py vectors.txt vectors
+if __name__ == "__main__":
+    convert_txt_to_npy(sys.argv[1], sys.argv[2])
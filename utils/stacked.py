@@ -0,0 +1,87 @@
+import datetime
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+
+import load_vectors
+from utils import align_vocab
+
+# the WEAT and similarity maths is shared with double_hard_utils, which batches over a leading model axis
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Doube_Hard_Debias'))
+from double_hard_utils import unit_rows, weat_scores
+
+# A stack holds every model aligned on their shared vocabulary as one [models x words x dim] float32 tensor:
+# <prefix>.npy is the tensor, <prefix>.vocab the shared words and <prefix>.models.json the model labels.
+
+
+# align the models on their shared vocabulary and write them into one memory-mapped tensor,
+# loading a single model at a time; labels are (embedding, model) pairs such as ('Original', 'w2v')
+def build_stack(files, labels, out_prefix, fmts=None):
+    fmts = fmts or [None] * len(files)
+    words, index = align_vocab(files, out_prefix + '.align.npz', fmts)
+
+    stack = None
+    for m, (file, fmt) in enumerate(zip(files, fmts)):
+        start_time = datetime.datetime.now()
+        if file.endswith('.npy') or fmt == 'npy':
+            vectors, _, _ = load_vectors.load_npy_arrays(file[:-len('.npy')] if file.endswith('.npy') else file)
+        else:
+            vectors = load_vectors.load_model(file, fmt).vectors
+        if stack is None:
+            stack = open_memmap(out_prefix + '.npy', mode='w+', dtype=np.float32,
+                                shape=(len(files), len(words), vectors.shape[1]))
+        stack[m] = vectors[index[m]]
+        del vectors
+        print(f'{file} stacked in {datetime.datetime.now() - start_time}')
+
+    stack.flush()
+    load_vectors.write_vocab(words, out_prefix + '.vocab')
+    with open(out_prefix + '.models.json', 'w') as f:
+        json.dump([list(label) for label in labels], f)
+
+# open a stack as a read-only memory map with its shared words, their indices and the model labels
+def load_stack(prefix):
+    stack = np.load(prefix + '.npy', mmap_mode='r')
+    words = load_vectors.read_vocab(prefix + '.vocab')
+    with open(prefix + '.models.json') as f:
+        labels = [tuple(label) for label in json.load(f)]
+    return stack, words, {w: i for i, w in enumerate(words)}, labels
+
+
+# WEAT effect size of every test for every model, as [models x tests], from one batched product;
+# words missing from the shared vocabulary are left out of their group
+def effect_size_matrix(stack, w2i, weat_data):
+    return np.stack([d for _, _, d in weat_scores(weat_data, stack, w2i)], axis=1)
+
+# cos(u, a) - cos(u, b) for every word of every model, using each model's own anchor vectors, as
+# [models x words]; computed in chunks of words so the memory-mapped tensor is never fully loaded
+def projection_bias(stack, w2i, a, b, chunk=20000):
+    anchors = unit_rows([a, b], stack, w2i)
+    direction = anchors[:, 0] - anchors[:, 1]
+
+    bias = np.zeros(stack.shape[:2], dtype=np.float32)
+    for start in range(0, stack.shape[1], chunk):
+        X = np.asarray(stack[:, start:start + chunk, :], dtype=np.float32)
+        bias[:, start:start + chunk] = np.einsum('mwd,md->mw', X, direction) / np.linalg.norm(X, axis=2)
+    return bias
+
+# cosine similarity of word pairs in every model, as [models x pairs]; pairs with a missing word are nan
+def pair_similarities(stack, w2i, pairs):
+    known = [p for p, (a, b) in enumerate(pairs) if a in w2i and b in w2i]
+    sims = np.full((len(stack), len(pairs)), np.nan)
+    if known:
+        U1 = unit_rows([pairs[p][0] for p in known], stack, w2i)
+        U2 = unit_rows([pairs[p][1] for p in known], stack, w2i)
+        sims[:, known] = np.einsum('mpd,mpd->mp', U1, U2)
+    return sims
+
+# turn a [models x tests] score matrix into the long Embedding/Test/Model/Score format read by graph_scores
+def scores_frame(scores, labels, tests):
+    rows = [{'Embedding': embedding, 'Test': test, 'Model': model, 'Score': round(float(score), 5)}
+            for (embedding, model), model_scores in zip(labels, scores)
+            for test, score in zip(tests, model_scores)]
+    return pd.DataFrame(rows, columns=['Embedding', 'Test', 'Model', 'Score'])
@@ -1,13 +1,28 @@
+import sys
+
+import numpy as np
+
 import load_vectors
 
 
+# usage: python utils.py align out.npz model1.txt model2.txt ...
 def main():
-    return
+    if len(sys.argv) > 3 and sys.argv[1] == 'align':
+        align_vocab(sys.argv[3:], sys.argv[2])
+
 
+# return the top 20 most similar word vectors in the vocabulary,
+# optionally from an approximate ann_index.IVFIndex built over the same vectors
+def most_similar(model, target, index=None):
+    if index is None:
+        return model.most_similar(positive = target, topn=20)
 
-# return the top 20 most similar word vectors in the vocabulary
-def most_similar(model, target):
-    return model.most_similar(positive = target, topn=20)
+    words = [target] if isinstance(target, str) else list(target)
+    query = np.mean([model[w] / np.linalg.norm(model[w]) for w in words], axis=0)
+    ids, scores = index.search(query, k=20 + len(words))
+    similar = [(model.index2word[i], float(s)) for i, s in zip(ids[0], scores[0])
+               if i >= 0 and model.index2word[i] not in words]
+    return similar[:20]
 
 
 # save word2vec and fastText models as text files with the word followed by the vector on each line
@@ -21,13 +36,11 @@ def convert_to_w2v_format(w2v_in, fast_in, w2v_name, fast_name):
 
 
 # given two models, one as a text files and one Gensim word2vec, identify different words in each vocabulary
-def id_diff_vocab():
-    print('loading glove')
-    glove_model = load_vectors.load_txt_format('glove_vectors.txt')
-    print('loading w2v')
-    w2v_model = load_vectors.load_w2v('w2v_vectors')
-    glove_vocab = list(glove_model.vocab)
-    w2v_vocab = list(w2v_model.wv.vocab)
+def id_diff_vocab(glove_file='glove_vectors.txt', w2v_file='w2v_vectors'):
+    print('loading glove vocabulary')
+    glove_vocab = load_vectors.load_vocab(glove_file)
+    print('loading w2v vocabulary')
+    w2v_vocab = load_vectors.load_vocab(w2v_file)
 
     # find the difference between the vocabularies
     diff_vocab = set(glove_vocab).symmetric_difference(w2v_vocab)
@@ -47,5 +60,28 @@ def id_diff_vocab():
         for v in diff_vocab:
             file.write(v + '\n')
 
+
+# align the vocabularies of any number of models on the words they all share, in the order of the first model,
+# and save the shared words with each model's row index for them as an .npz file
+def align_vocab(files, out_file, fmts=None):
+    vocabs = [load_vectors.load_vocab(f, fmt) for f, fmt in zip(files, fmts or [None] * len(files))]
+    shared = set(vocabs[0]).intersection(*vocabs[1:])
+    words = [w for w in vocabs[0] if w in shared]
+
+    index = np.zeros((len(vocabs), len(words)), dtype=np.int64)
+    for m, vocab in enumerate(vocabs):
+        w2i = {w: i for i, w in enumerate(vocab)}
+        index[m] = [w2i[w] for w in words]
+        print(f'{files[m]}: {len(vocab)} words, {len(vocab) - len(words)} not shared')
+
+    np.savez(out_file, words=np.array(words), index=index, files=np.array(files))
+    print('shared vocabulary:', len(words))
+    return words, index
+
+# read an alignment saved by align_vocab
+def load_alignment(file):
+    data = np.load(file)
+    return list(data['words']), data['index'], list(data['files'])
+
 if __name__ == "__main__":
     main()
\ No newline at end of file